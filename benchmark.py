@@ -0,0 +1,314 @@
+"""
+Micro-benchmarks for the catcher_rover hot paths.
+
+Each benchmark prints its measurements on stdout. Run one with:
+
+    python3 benchmark.py <name> [args...]
+
+function bench_upload: Compare frame upload strategies over a socket pair.
+
+function bench_bindings: Measure the per-frame cost of binding Darknet calls.
+
+function bench_backends: Compare the Darknet and OpenCV DNN backends.
+"""
+
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+
+import numpy as np #pylint: disable=import-error
+
+import main
+import socks
+import pydarknet as pdn
+
+
+class CountingSocket():
+    """Socket proxy counting the send calls issued from Python.
+
+    Calls made through socket.sendfile are counted per underlying
+    os.sendfile call.
+
+    Attributes:
+        calls: An int counting the send-family calls issued.
+    """
+
+    def __init__(self, sock):
+        """CountingSocket default builder."""
+
+        self._sock = sock
+        self.calls = 0
+
+
+    def __getattr__(self, name):
+        """Forward anything else to the wrapped socket."""
+
+        return getattr(self._sock, name)
+
+
+    def send(self, data):
+        """Counted send."""
+
+        self.calls += 1
+        return self._sock.send(data)
+
+
+    def sendall(self, data):
+        """Counted sendall."""
+
+        self.calls += 1
+        return self._sock.sendall(data)
+
+
+    def sendmsg(self, buffers):
+        """Counted sendmsg."""
+
+        self.calls += 1
+        return self._sock.sendmsg(buffers)
+
+
+    def sendfile(self, filedesc, offset=0, count=None):
+        """Counted sendfile, one count per kernel sendfile call."""
+
+        real_sendfile = os.sendfile
+
+        def counted(*args):
+            self.calls += 1
+            return real_sendfile(*args)
+
+        os.sendfile = counted
+        try:
+            return self._sock.sendfile(filedesc, offset, count)
+        finally:
+            os.sendfile = real_sendfile
+
+
+def legacy_send_frame(client_socket, frame_loc):
+    """Reference implementation of the former readline-based upload."""
+
+    with open(frame_loc, 'rb') as filedesc:
+        buf = filedesc.readline(1024)
+        while buf:
+            client_socket.send(buf)
+            buf = filedesc.readline(1024)
+
+
+def _drain(sock, total):
+    """Read and discard total bytes from sock."""
+
+    buf = bytearray(1 << 16)
+    while total > 0:
+        nbytes = sock.recv_into(buf)
+        if nbytes == 0:
+            return
+        total -= nbytes
+
+
+def bench_upload(frame_loc=None, rounds=200):
+    """Compare frame upload strategies over a local socket pair.
+
+    Args:
+        frame_loc: Optional string representing a JPEG frame to upload. A
+        random 200kB payload is used when omitted.
+        rounds: An int representing the number of uploads per strategy.
+
+    Returns:
+        A dict mapping strategy name to (calls per frame, ms per frame).
+    """
+
+    rounds = int(rounds)
+    tmp = None
+    if frame_loc is None:
+        tmp = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+        tmp.write(os.urandom(200 * 1024))
+        tmp.close()
+        frame_loc = tmp.name
+
+    with open(frame_loc, 'rb') as filedesc:
+        frame = filedesc.read()
+
+    strategies = {
+        'legacy readline': lambda sock: legacy_send_frame(sock, frame_loc),
+        'sendfile': lambda sock: socks.send_frame(sock, frame_loc),
+        'in-memory': lambda sock: socks.send_frame_bytes(sock, frame),
+    }
+    overhead = {'legacy readline': 0}
+
+    results = {}
+    for name, upload in strategies.items():
+        sender, receiver = socket.socketpair()
+        counting = CountingSocket(sender)
+        expected = (len(frame) + overhead.get(name, socks.HEADER.size)) * rounds
+        drain = threading.Thread(target=_drain, args=(receiver, expected))
+        drain.start()
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            upload(counting)
+        drain.join()
+        elapsed = time.perf_counter() - start
+
+        sender.close()
+        receiver.close()
+        results[name] = (counting.calls / rounds, 1000 * elapsed / rounds)
+        print("%-16s %8.1f send calls/frame %8.3f ms/frame"
+              % (name, results[name][0], results[name][1]))
+
+    if tmp is not None:
+        os.remove(tmp.name)
+
+    return results
+
+
+def bench_bindings(libpath='libdarknet.so', rounds=100000):
+    """Measure the per-frame cost of binding Darknet calls.
+
+    Compares the symbol lookups and argtypes/restype assignments detect used
+    to perform on every frame with attribute reads from the bound api table.
+    No Darknet function is actually called.
+
+    Args:
+        libpath: A string representing the Darknet library path.
+        rounds: An int representing the number of simulated frames.
+
+    Returns:
+        A dict mapping strategy name to microseconds per frame.
+    """
+
+    rounds = int(rounds)
+    dark = pdn.Pydarknet(libpath)
+    rebinders = [dark.init_load_image, dark.init_predict, dark.init_set_gpu,
+                 dark.init_make_image, dark.init_predict_image,
+                 dark.init_get_network_boxes, dark.init_do_nms_obj,
+                 dark.init_free_image, dark.init_free_detections]
+
+    def rebind():
+        for init in rebinders:
+            init()
+
+    def bound():
+        api = dark.api
+        return (api.load_image, api.predict_image, api.get_network_boxes,
+                api.do_nms_obj, api.free_image, api.free_detections)
+
+    results = {}
+    for name, per_frame in (('rebind per call', rebind),
+                            ('bound api', bound)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            per_frame()
+        results[name] = 1e6 * (time.perf_counter() - start) / rounds
+        print("%-16s %8.2f us/frame" % (name, results[name]))
+
+    return results
+
+
+def box_iou(box_a, box_b):
+    """Intersection over union of two (x, y, w, h) center boxes."""
+
+    inter_w = (min(box_a[0] + box_a[2] / 2, box_b[0] + box_b[2] / 2)
+               - max(box_a[0] - box_a[2] / 2, box_b[0] - box_b[2] / 2))
+    inter_h = (min(box_a[1] + box_a[3] / 2, box_b[1] + box_b[3] / 2)
+               - max(box_a[1] - box_a[3] / 2, box_b[1] - box_b[3] / 2))
+    inter = max(0.0, inter_w) * max(0.0, inter_h)
+    union = box_a[2] * box_a[3] + box_b[2] * box_b[3] - inter
+
+    return inter / union if union > 0 else 0.0
+
+
+def match_boxes(reference, candidate, min_iou=0.5):
+    """Greedily match same-class detections of two backends.
+
+    Args:
+        reference: A list of (class, prob, box) detections.
+        candidate: A list of (class, prob, box) detections.
+        min_iou: A float representing the IoU needed to match two boxes.
+
+    Returns:
+        A list holding the IoU of every matched reference detection.
+    """
+
+    unmatched = list(candidate)
+    ious = []
+    for ref_class, _, ref_box in reference:
+        scored = [(box_iou(ref_box, box), index)
+                  for index, (cls, _, box) in enumerate(unmatched)
+                  if cls == ref_class]
+        if scored:
+            iou, index = max(scored)
+            if iou >= min_iou:
+                ious.append(iou)
+                del unmatched[index]
+
+    return ious
+
+
+def bench_backends(cfg, weights, data, *frame_locs, rounds=5):
+    """Compare the Darknet and OpenCV DNN backends on the same frames.
+
+    Darknet detections are the reference: agreement is the share of them
+    the OpenCV backend also reports, same class and IoU of at least 0.5.
+
+    Args:
+        cfg: A string representing the cfg file path.
+        weights: A string representing the weight file path.
+        data: A string representing the data file path.
+        frame_locs: Strings representing the image files to detect on.
+        rounds: An int representing the timed passes over the frames.
+
+    Returns:
+        A dict with the ms per frame of each backend, the box agreement and
+        the mean IoU of matched boxes.
+    """
+
+    rounds = int(rounds)
+    frames = []
+    for loc in frame_locs:
+        with open(loc, 'rb') as filedesc:
+            frames.append(pdn.decode_image(filedesc.read()))
+
+    detections = {}
+    results = {}
+    for backend in ('darknet', 'opencv'):
+        dark, network, metadata = main.darknet_model(cfg, weights, data,
+                                                     backend)
+        detections[backend] = [dark.detect_array((network, metadata, frame))
+                               for frame in frames]
+
+        latencies = []
+        for _ in range(rounds):
+            for frame in frames:
+                start = time.perf_counter()
+                dark.detect_array((network, metadata, frame))
+                latencies.append(1000 * (time.perf_counter() - start))
+        dark.close()
+
+        results[backend] = float(np.mean(latencies))
+        print("%-8s %8.2f ms/frame mean %8.2f ms/frame p50"
+              % (backend, results[backend], float(np.median(latencies))))
+
+    ious = []
+    reference = 0
+    for darknet_dets, opencv_dets in zip(detections['darknet'],
+                                         detections['opencv']):
+        reference += len(darknet_dets)
+        ious.extend(match_boxes(darknet_dets, opencv_dets))
+
+    results['agreement'] = len(ious) / reference if reference else 1.0
+    results['mean_iou'] = float(np.mean(ious)) if ious else 0.0
+    print("%d darknet boxes, %.1f%% matched by opencv, mean IoU %.3f"
+          % (reference, 100 * results['agreement'], results['mean_iou']))
+
+    return results
+
+
+BENCHMARKS = {'upload': bench_upload,
+              'bindings': bench_bindings,
+              'backends': bench_backends}
+
+
+if __name__ == '__main__':
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
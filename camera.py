@@ -2,12 +2,304 @@
 """
 Module supporting the Camera class, responsible for taking snapshots.
 
+function fit_frame: Downscale a frame to fit in a given size.
+
+function encode_jpeg: Encode a frame to JPEG in memory.
+
+class ChangeDetector: flags frames differing from the last uploaded one.
+
+class FrameOverrun: raised when a requested frame was already overwritten.
+
+class FrameRing: fixed ring of preallocated, timestamped frame slots.
+
 class Camera: contains the builder and the main capture function.
 
 """
 
 import os
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
+import numpy as np #pylint: disable=import-error
+
+
+# Chroma subsampling names to OpenCV sampling factors; older OpenCV builds
+# without IMWRITE_JPEG_SAMPLING_FACTOR keep libjpeg's default (4:2:0).
+JPEG_SUBSAMPLING = {name: getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR_' + name,
+                                  None)
+                    for name in ('411', '420', '422', '444')}
+
+
+def fit_frame(frame, width, height):
+    """Downscale a frame to fit in width x height, keeping its aspect ratio.
+
+    This matches the letterbox Darknet applies to its input: the frame is
+    scaled by the same factor on both axes and never upscaled.
+
+    Args:
+        frame: A HWC NumPy array representing the frame.
+        width: An int representing the maximum width.
+        height: An int representing the maximum height.
+
+    Returns:
+        A tuple (frame, scale), scale being the factor applied to the frame.
+    """
+
+    frm_height, frm_width = frame.shape[:2]
+    scale = min(width / frm_width, height / frm_height, 1.0)
+
+    if scale < 1.0:
+        size = (max(1, round(frm_width * scale)),
+                max(1, round(frm_height * scale)))
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    return frame, scale
+
+
+def encode_jpeg(frame, quality=95, size=None, subsampling=None):
+    """Encode a frame to JPEG in memory.
+
+    Args:
+        frame: A HWC NumPy array representing the frame.
+        quality: An int from 0 to 100 representing the JPEG quality.
+        size: Optional (width, height) tuple the frame is downscaled to fit.
+        subsampling: Optional string among '411', '420', '422' and '444'
+        representing the chroma subsampling.
+
+    Returns:
+        A tuple (buf, scale): buf is the encoded JPEG buffer and scale the
+        factor applied to the frame.
+
+    Raises:
+        ValueError: The frame could not be encoded.
+    """
+
+    scale = 1.0
+    if size is not None:
+        frame, scale = fit_frame(frame, *size)
+
+    params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    factor = None if subsampling is None else JPEG_SUBSAMPLING[subsampling]
+    if factor is not None:
+        params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, factor]
+
+    encoded, buf = cv2.imencode('.jpg', frame, params)
+    if not encoded:
+        raise ValueError("cannot encode frame")
+
+    return buf, scale
+
+
+class ChangeDetector:
+    """Class flagging frames that differ from the last uploaded one.
+
+    Frames are reduced to a small grayscale thumbnail and compared, by mean
+    absolute pixel difference, against the thumbnail of the last frame that
+    was flagged as changed. Comparing against that reference rather than
+    the previous frame keeps slow drifts from going unnoticed.
+
+    Attributes:
+        threshold: A float representing the mean difference (0-255) below
+        which a frame is considered unchanged; 0 flags every frame.
+        size: A (width, height) tuple representing the thumbnail size.
+        changed_count: An int counting the frames flagged as changed.
+        skipped_count: An int counting the frames flagged as unchanged.
+    """
+
+    def __init__(self, threshold, size=(32, 24)):
+        """Init ChangeDetector with threshold and thumbnail size."""
+
+        self.threshold = threshold
+        self.size = size
+        self.changed_count = 0
+        self.skipped_count = 0
+        self._reference = None
+
+
+    def changed(self, frame):
+        """Tell whether frame differs enough from the reference frame.
+
+        A changed frame becomes the new reference.
+
+        Args:
+            frame: A HWC BGR NumPy array representing the frame.
+
+        Returns:
+            A bool, True when the frame should be uploaded.
+        """
+
+        thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), self.size,
+                           interpolation=cv2.INTER_AREA).astype(np.int16)
+
+        if (self._reference is None or self.threshold <= 0
+                or np.abs(thumb - self._reference).mean() >= self.threshold):
+            self._reference = thumb
+            self.changed_count += 1
+            return True
+
+        self.skipped_count += 1
+        return False
+
+
+class FrameOverrun(Exception):
+    """Raised when a requested frame was already overwritten in the ring."""
+
+
+class FrameRing:
+    """Fixed ring of preallocated, timestamped frame slots.
+
+    A single producer fills slots in place, each frame getting the next
+    sequence number. Consumers read zero-copy views of the slots; a view
+    stays valid until slots newer frames have been written, which intact
+    lets consumers check after using it.
+
+    Attributes:
+        slots: An int representing the number of frame slots.
+        shape: A tuple representing the shape of a frame.
+        overruns: An int counting the reads of already overwritten frames.
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint8):
+        """Init FrameRing with its slot count and frame shape."""
+
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.overruns = 0
+        self._frames = np.empty((slots,) + self.shape, dtype=dtype)
+        self._stamps = np.zeros(slots, dtype=np.float64)
+        self._seqs = np.full(slots, -1, dtype=np.int64)
+        self._next = 0
+        self._newest = -1
+        self._cond = threading.Condition()
+
+
+    def claim(self):
+        """Claim the slot of the next frame, for the producer to fill.
+
+        Args:
+            None
+
+        Returns:
+            A tuple (seq, slot): the frame sequence number and a writable
+            view of its slot.
+        """
+
+        with self._cond:
+            seq = self._next
+            self._next += 1
+            self._seqs[seq % self.slots] = -1
+
+        return seq, self._frames[seq % self.slots]
+
+
+    def publish(self, seq, stamp):
+        """Make a filled slot visible to consumers.
+
+        Args:
+            seq: An int representing the sequence number from claim.
+            stamp: A float representing the frame capture time.
+
+        Returns:
+            None
+        """
+
+        with self._cond:
+            self._stamps[seq % self.slots] = stamp
+            self._seqs[seq % self.slots] = seq
+            self._newest = seq
+            self._cond.notify_all()
+
+
+    def latest(self):
+        """Return the newest published frame without blocking.
+
+        Args:
+            None
+
+        Returns:
+            A tuple (seq, stamp, frame), frame being a read-only view, or
+            (None, None, None) before the first frame.
+        """
+
+        with self._cond:
+            return self._newest_entry()
+
+
+    def wait(self, after=-1, timeout=None):
+        """Block until a frame newer than after is published.
+
+        Args:
+            after: An int representing the last sequence number seen.
+            timeout: Optional float representing the maximum wait in seconds.
+
+        Returns:
+            A tuple (seq, stamp, frame) as latest returns, or
+            (None, None, None) when no newer frame came within timeout.
+        """
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._newest > after, timeout):
+                return None, None, None
+            return self._newest_entry()
+
+
+    def get(self, seq):
+        """Return a given frame.
+
+        Args:
+            seq: An int representing the frame sequence number.
+
+        Returns:
+            A tuple (stamp, frame), frame being a read-only view.
+
+        Raises:
+            FrameOverrun: The frame was overwritten, or not published yet.
+        """
+
+        with self._cond:
+            if self._seqs[seq % self.slots] != seq:
+                self.overruns += 1
+                raise FrameOverrun("frame %d is no longer in the ring" % seq)
+            return self._entry(seq)[1:]
+
+
+    def intact(self, seq):
+        """Tell whether a frame is still in its slot.
+
+        Check it after using a view to detect an overrun during the read.
+
+        Args:
+            seq: An int representing the frame sequence number.
+
+        Returns:
+            A bool, False once the slot was claimed for a newer frame.
+        """
+
+        with self._cond:
+            return bool(self._seqs[seq % self.slots] == seq)
+
+
+    def _newest_entry(self):
+        """Return the newest frame entry, or Nones if none is intact."""
+
+        seq = self._newest
+        if seq < 0 or self._seqs[seq % self.slots] != seq:
+            return None, None, None
+
+        return self._entry(seq)
+
+
+    def _entry(self, seq):
+        """Return (seq, stamp, read-only view) of a published frame."""
+
+        frame = self._frames[seq % self.slots].view()
+        frame.flags.writeable = False
+
+        return seq, float(self._stamps[seq % self.slots]), frame
+
 
 class Camera:
     """Class responsible for taking frames captures from webcam.
@@ -16,16 +308,43 @@ class Camera:
     called capture. Directly capture frames from the existing webcam.
     Relies on cv2 from frames capture and save.
 
+    Once started, either with start or as a context manager, the device
+    stays open and a daemon thread keeps grabbing frames, so latest returns
+    the newest frame at once and capture no longer reopens the device.
+    Frames are read in place into a FrameRing of ring_size preallocated
+    slots, so memory use stays constant and consumers share frames.
+
     Attributes:
         device = An integer indicating the webcam device to use.
         path = A string indicating the path where frames are saved.
+        ring = The FrameRing holding the grabbed frames, None until started.
     """
 
-    def __init__(self, path='./', device=0):
+    def __init__(self, path='./', device=0, ring_size=4):
         """Init Camera with device nbr and path."""
 
         self._path = path
         self._device = device
+        self._ring_size = ring_size
+        self._cap = None
+        self._grabber = None
+        self._stop = threading.Event()
+        self._last_seq = -1
+        self._encoder = None
+        self.ring = None
+
+
+    def __enter__(self):
+        """Start the persistent capture."""
+
+        self.start()
+        return self
+
+
+    def __exit__(self, *_):
+        """Stop the persistent capture."""
+
+        self.stop()
 
 
     @property
@@ -84,22 +403,205 @@ class Camera:
         self._device = device
 
 
-    def capture(self):
+    def start(self):
+        """Open the device once and start the grabber thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        Raises:
+            OSError: The device could not be opened.
+        """
+
+        if self._grabber is not None:
+            return
+
+        self._cap = cv2.VideoCapture(self.device)
+        grabbed, frm = self._cap.read() if self._cap.isOpened() else (False, None)
+        if not grabbed:
+            self._cap.release()
+            self._cap = None
+            raise OSError("cannot open camera device %s" % str(self.device))
+
+        if self.ring is None or self.ring.shape != frm.shape:
+            self.ring = FrameRing(self._ring_size, frm.shape, frm.dtype)
+
+        self._stop.clear()
+        self._grabber = threading.Thread(target=self._grab, daemon=True)
+        self._grabber.start()
+
+
+    def stop(self):
+        """Stop the grabber and encoder threads and release the device.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        if self._encoder is not None:
+            self._encoder.shutdown()
+            self._encoder = None
+
+        if self._grabber is None:
+            return
+
+        self._stop.set()
+        self._grabber.join()
+        self._grabber = None
+
+        self._cap.release()
+        self._cap = None
+
+
+    def _grab(self):
+        """Grabber thread body: fill ring slots until stopped.
+
+        A failed read retries into the same slot, so a failing device never
+        invalidates more than the one slot being filled.
+        """
+
+        slot = None
+        while not self._stop.is_set():
+            if slot is None:
+                seq, slot = self.ring.claim()
+            grabbed, frm = self._cap.read(slot)
+            if grabbed and frm is not slot:
+                grabbed = frm.shape == slot.shape
+                if grabbed:
+                    np.copyto(slot, frm)
+            if not grabbed:
+                time.sleep(0.01)
+                continue
+
+            self.ring.publish(seq, time.monotonic())
+            slot = None
+
+
+    def latest(self):
+        """Return the newest grabbed frame without blocking.
+
+        Args:
+            None
+
+        Returns:
+            A tuple (frame, timestamp): a read-only view of the newest ring
+            slot and its time.monotonic capture time, or (None, None) before
+            the first frame.
+        """
+
+        if self.ring is None:
+            return None, None
+
+        _, stamp, frame = self.ring.latest()
+        return frame, stamp
+
+
+    def capture(self, save=True, timeout=2.0):
         """Capture frames from webcam.
 
         Starts the existing camera bound to the computer and starts
         taking snapshots, or frames. Relies on the cv2 library call
         for snapshots. Takes snapshots and saves them under self.path.
+        When the persistent capture is running, the next grabbed frame
+        is used instead of reopening the device; it is a read-only view of
+        a ring slot, valid until ring_size newer frames are grabbed.
 
         Args:
-            None
+            save: A bool; when False, the frame is not written to
+            self.path/frame.jpg.
+            timeout: A float representing the maximum wait in seconds for
+            the next grabbed frame.
 
         Returns:
+            A HWC NumPy array representing the captured frame.
+
+        Raises:
+            OSError: The persistent capture grabbed no frame within timeout.
+        """
+
+        if self._grabber is not None:
+            seq, _, frm = self.ring.wait(self._last_seq, timeout)
+            if seq is None:
+                raise OSError("no frame from camera device %s in %.1f s"
+                              % (str(self.device), timeout))
+            self._last_seq = seq
+        else:
+            cap = cv2.VideoCapture(self.device)
+            _, frm = cap.read()
+            cap.release()
+
+        if save:
+            cv2.imwrite(os.path.join(self.path, "frame.jpg"), frm)
+
+        return frm
+
+
+    def intact(self):
+        """Tell whether the frame last returned by capture is still valid.
+
+        Check it after using the frame, e.g. once it is encoded, to detect
+        that the grabber overwrote its ring slot meanwhile.
+
+        Args:
             None
+
+        Returns:
+            A bool, always True without the persistent capture, which
+            returns frames the caller owns.
+        """
+
+        if self._grabber is None or self._last_seq < 0:
+            return True
+
+        return self.ring.intact(self._last_seq)
+
+
+    def encode(self, frame, quality=95, size=None, subsampling=None):
+        """Encode a frame to JPEG in memory, in the encoder thread.
+
+        The encoder thread is started on first use and stopped by stop.
+
+        Args:
+            frame: A HWC NumPy array representing the frame.
+            quality: An int from 0 to 100 representing the JPEG quality.
+            size: Optional (width, height) tuple the frame is downscaled to
+            fit.
+            subsampling: Optional string among '411', '420', '422' and '444'
+            representing the chroma subsampling.
+
+        Returns:
+            A concurrent.futures.Future resolving to the (buf, scale) tuple
+            encode_jpeg returns.
+        """
+
+        if self._encoder is None:
+            self._encoder = ThreadPoolExecutor(max_workers=1)
+
+        return self._encoder.submit(encode_jpeg, frame, quality, size,
+                                    subsampling)
+
+
+    def capture_encoded(self, quality=95, size=None, subsampling=None):
+        """Capture a frame and encode it in memory, without touching disk.
+
+        Args:
+            quality: An int from 0 to 100 representing the JPEG quality.
+            size: Optional (width, height) tuple the frame is downscaled to
+            fit.
+            subsampling: Optional string among '411', '420', '422' and '444'
+            representing the chroma subsampling.
+
+        Returns:
+            A tuple (frame, future): the captured frame, and a Future
+            resolving to its (buf, scale) encoding.
         """
 
-        cap = cv2.VideoCapture(self.device)
-        _, frm = cap.read()
+        frm = self.capture(save=False)
 
-        cv2.imwrite(os.path.join(self.path, "frame.jpg"), frm)
-        cap.release()
+        return frm, self.encode(frm, quality, size, subsampling)
@@ -0,0 +1,452 @@
+"""
+Module supporting the OpenCV DNN inference backend.
+
+It runs the same Darknet cfg and weights through cv2.dnn, which is
+multithreaded on CPU and accepts batches. CvDarknet mirrors the Pydarknet
+methods the server relies on (network_size, class_ids, classify, detect,
+prepare_frame, detect_prepared, detect_array, detect_bytes, detect_batch
+and native_allocations), so a (backend, network, metadata) model tuple from
+either module can be used interchangeably.
+
+function read_names: read the class names listed by a Darknet data file.
+
+function load_model: load a Darknet model through cv2.dnn.
+
+class CvDarknet: OpenCV DNN implementation of the Pydarknet detection API.
+"""
+
+import time
+import collections
+
+import numpy as np #pylint: disable=import-error
+import cv2 #pylint: disable=import-error
+
+import pydarknet as pdn
+
+
+CvNetwork = collections.namedtuple('CvNetwork', [
+    'net', 'width', 'height', 'outputs'])
+CvNetwork.__doc__ = """A cv2.dnn network with its input size and output layer names."""
+
+CvMetadata = collections.namedtuple('CvMetadata', ['classes', 'names'])
+CvMetadata.__doc__ = """Class count and names (bytes), laid out as METADATA."""
+
+
+def read_names(data):
+    """Read the class names listed by a Darknet data file.
+
+    Args:
+        data: A string representing the data file path.
+
+    Returns:
+        A list of class names as bytes, in class index order.
+    """
+
+    names_loc = None
+    with open(data) as data_file:
+        for line in data_file:
+            if '=' in line:
+                key, value = line.split('=', 1)
+                if key.strip() == 'names':
+                    names_loc = value.strip()
+
+    with open(names_loc) as names_file:
+        return [line.strip().encode('utf-8') for line in names_file
+                if line.strip()]
+
+
+def load_model(cfg, weights, data, threads=None):
+    """Load a Darknet model through cv2.dnn.
+
+    Args:
+        cfg: A string representing the cfg file path.
+        weights: A string representing the weight file path.
+        data: A string representing the data file path.
+        threads: Optional int representing the number of OpenCV threads.
+
+    Returns:
+        A model tuple: (CvDarknet, CvNetwork, CvMetadata).
+    """
+
+    if threads is not None:
+        cv2.setNumThreads(threads)
+
+    net = cv2.dnn.readNet(weights, cfg)
+    net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+    net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    options = pdn.cfg_net_options(cfg)
+    network = CvNetwork(net, int(options.get('width', 416)),
+                        int(options.get('height', 416)),
+                        net.getUnconnectedOutLayersNames())
+
+    names = read_names(data)
+
+    return CvDarknet(), network, CvMetadata(len(names), names)
+
+
+class CvDarknet():
+    """OpenCV DNN implementation of the Pydarknet detection API.
+
+    Frames are letterboxed exactly as Pydarknet.prepare_frame does, so both
+    backends see the same network input. Non-maximum suppression runs once
+    for all classes, in a single cv2.dnn.NMSBoxes call.
+    """
+
+    def __init__(self):
+        """CvDarknet default builder."""
+
+        self._class_tables = {}
+
+
+    def close(self):
+        """Release backend resources; nothing is held natively.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+
+    def native_allocations(self):
+        """Report the native Darknet allocations currently alive.
+
+        Args:
+            None
+
+        Returns:
+            An empty dict, cv2.dnn managing its own memory.
+        """
+
+        return {}
+
+
+    def network_size(self, net):
+        """Return the network input size.
+
+        Args:
+            net: A CvNetwork instance.
+
+        Returns:
+            A (width, height) tuple.
+        """
+
+        return net.width, net.height
+
+
+    def class_index(self, meta):
+        """Return the name to class index table of a model.
+
+        Args:
+            meta: A CvMetadata instance.
+
+        Returns:
+            A dict mapping class names (str) to class indices.
+        """
+
+        table = self._class_tables.get(id(meta.names))
+        if table is None:
+            table = {name.decode('utf-8'): i
+                     for i, name in enumerate(meta.names)}
+            self._class_tables[id(meta.names)] = table
+
+        return table
+
+
+    def class_ids(self, meta, classes):
+        """Resolve class names or indices into class indices.
+
+        Args:
+            meta: A CvMetadata instance.
+            classes: An iterable of class names (str) or indices (int).
+
+        Returns:
+            A list of class indices.
+
+        Raises:
+            KeyError: A class name is not part of the model.
+        """
+
+        table = self.class_index(meta)
+
+        return [cls if isinstance(cls, int) else table[cls] for cls in classes]
+
+
+    def classify(self, net, meta, img):
+        """Classify an image.
+
+        The image is letterboxed to the network size, as Darknet
+        network_predict_image does, and the output of the last layer is
+        read as one score per class.
+
+        Args:
+            net: A CvNetwork instance representing a classifier network.
+            meta: A CvMetadata instance.
+            img: A HWC (or HW grayscale) uint8 NumPy array in BGR order.
+
+        Returns:
+            A list of (name, prob) tuples sorted by decreasing probability.
+        """
+
+        planes, _ = self.prepare_frame(net, img)
+        net.net.setInput(planes[np.newaxis])
+        out = net.net.forward().reshape(-1)
+
+        res = [(meta.names[i], float(out[i])) for i in range(meta.classes)]
+        return sorted(res, key=lambda x: -x[1])
+
+
+    def detect(self, model, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments
+               top_k=None, raw=False, classes=None):
+        """Detect objects in an image file.
+
+        Args:
+            model: A tuple (net, meta, image), image being the image path as
+            bytes or str.
+            thresh: An float representing the detection threshold.
+            hier_thresh: Unused, kept for Pydarknet compatibility.
+            nms: A float representing the NMS overlap threshold.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return a RESULT_DTYPE structured array.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A list of detected objects bounding boxes as a result.
+
+        Raises:
+            IOError: The image cannot be read.
+        """
+
+        net, meta, image = model
+        if isinstance(image, bytes):
+            image = image.decode('utf-8')
+
+        frame = cv2.imread(image, cv2.IMREAD_COLOR)
+        if frame is None:
+            raise IOError("cannot read image: %s" % image)
+
+        return self.detect_array((net, meta, frame), thresh, hier_thresh, nms,
+                                 top_k, raw, classes)
+
+
+    def prepare_frame(self, net, frame):
+        """Letterbox a frame to the network size, ahead of inference.
+
+        Args:
+            net: A CvNetwork instance.
+            frame: A HWC (or HW grayscale) uint8 NumPy array in BGR order.
+
+        Returns:
+            A tuple (planes, geometry) as returned by pydarknet.letterbox_frame.
+        """
+
+        return pdn.letterbox_frame(frame, net.width, net.height)
+
+
+    def _forward(self, net, planes):
+        """Run a NCHW float32 blob through the network.
+
+        Args:
+            net: A CvNetwork instance.
+            planes: A NCHW float32 array of the network size.
+
+        Returns:
+            A list holding, per image, the YOLO rows (x, y, w, h,
+            objectness, class probabilities...) in network-relative units,
+            class probabilities being already scaled by objectness.
+        """
+
+        net.net.setInput(planes)
+        outs = net.net.forward(net.outputs)
+        outs = [out.reshape(len(planes), -1, out.shape[-1]) for out in outs]
+
+        return [np.concatenate([out[index] for out in outs])
+                for index in range(len(planes))]
+
+
+    def _detections(self, rows, net, options, class_ids): #pylint: disable=no-self-use
+        """Turn YOLO rows into a RESULT_DTYPE array in network pixels.
+
+        Args:
+            rows: A (N, 5 + classes) float32 array from _forward.
+            net: A CvNetwork instance.
+            options: A dict with thresh, nms and top_k entries.
+            class_ids: Optional sequence of class indices to inspect.
+
+        Returns:
+            A RESULT_DTYPE structured array sorted by decreasing probability.
+        """
+
+        # The yolo layer already writes objectness * class probability in
+        # the class columns.
+        scores = rows[:, 5:]
+        if class_ids is not None:
+            class_ids = np.asarray(class_ids, dtype=np.int32)
+            scores = scores[:, class_ids]
+
+        det_idx, class_idx = np.nonzero(scores > options['thresh'])
+        probs = scores[det_idx, class_idx]
+        boxes = rows[det_idx, :4] * np.float32([net.width, net.height,
+                                                 net.width, net.height])
+
+        if options['nms'] and len(probs):
+            # Shift each class far away from the others, so one NMS pass
+            # never suppresses boxes across classes.
+            extent = 2 * float(np.abs(boxes).max()) + 1
+            shift = (class_idx * extent)[:, np.newaxis]
+            corners = boxes[:, :2] - boxes[:, 2:] / 2 + shift
+            keep = cv2.dnn.NMSBoxes(np.hstack([corners, boxes[:, 2:]]),
+                                    probs, options['thresh'], options['nms'])
+            keep = np.asarray(keep, dtype=np.int64).reshape(-1)
+            boxes, probs, class_idx = boxes[keep], probs[keep], class_idx[keep]
+
+        order = np.argsort(-probs, kind='stable')[:options['top_k']]
+
+        if class_ids is not None:
+            class_idx = class_ids[class_idx]
+
+        res = np.empty(len(order), dtype=pdn.RESULT_DTYPE)
+        res['class_id'] = class_idx[order]
+        res['prob'] = probs[order]
+        for column, field in enumerate(('x', 'y', 'w', 'h')):
+            res[field] = boxes[order, column]
+
+        return res
+
+
+    def detect_prepared(self, net, meta, prepared, thresh=.5, hier_thresh=.5, #pylint: disable=too-many-arguments,unused-argument
+                        nms=.45, top_k=None, raw=False, classes=None):
+        """Detect objects in a frame prepared by prepare_frame.
+
+        Args:
+            net: A CvNetwork instance.
+            meta: A CvMetadata instance.
+            prepared: A tuple (planes, geometry) from prepare_frame.
+            thresh: An float representing the detection threshold.
+            hier_thresh: Unused, kept for Pydarknet compatibility.
+            nms: A float representing the NMS overlap threshold.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return a RESULT_DTYPE structured array.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A list of detected objects bounding boxes as a result.
+        """
+
+        planes, geometry = prepared
+        class_ids = None if classes is None else self.class_ids(meta, classes)
+
+        rows = self._forward(net, planes[np.newaxis])[0]
+        res = self._detections(rows, net, {'thresh': thresh, 'nms': nms,
+                                           'top_k': top_k}, class_ids)
+
+        return pdn.format_results(meta, pdn.unletterbox(res, geometry), raw,
+                                  class_ids is not None)
+
+
+    def detect_array(self, model, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments
+                     top_k=None, raw=False, classes=None):
+        """Detect objects in an in-memory frame.
+
+        Args:
+            model: A tuple (net, meta, frame), frame being a HWC uint8 NumPy
+            array in BGR order.
+            thresh: An float representing the detection threshold.
+            hier_thresh: Unused, kept for Pydarknet compatibility.
+            nms: A float representing the NMS overlap threshold.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return a RESULT_DTYPE structured array.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A list of detected objects bounding boxes as a result, in source
+            frame pixels.
+        """
+
+        net, meta, frame = model
+
+        return self.detect_prepared(net, meta, self.prepare_frame(net, frame),
+                                    thresh, hier_thresh, nms, top_k, raw,
+                                    classes)
+
+
+    def detect_bytes(self, model, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments
+                     top_k=None, raw=False, classes=None):
+        """Detect objects in an in-memory encoded image.
+
+        Args:
+            model: A tuple (net, meta, buf), buf being a bytes-like object
+            holding an encoded (e.g. JPEG) image.
+            thresh: An float representing the detection threshold.
+            hier_thresh: Unused, kept for Pydarknet compatibility.
+            nms: A float representing the NMS overlap threshold.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return a RESULT_DTYPE structured array.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A list of detected objects bounding boxes as a result.
+        """
+
+        net, meta, buf = model
+
+        return self.detect_array((net, meta, pdn.decode_image(buf)), thresh,
+                                 hier_thresh, nms, top_k, raw, classes)
+
+
+    def detect_batch(self, model, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments,too-many-locals,unused-argument
+                     batch_size=1, top_k=None, raw=False, classes=None):
+        """Detect objects in several in-memory images.
+
+        Frames of any resolution are letterboxed to the network size and go
+        through the network batch_size at a time.
+
+        Args:
+            model: A tuple (net, meta, frames), frames being a list of HWC
+            uint8 BGR arrays or of encoded images given as bytes.
+            thresh: An float representing the detection threshold.
+            hier_thresh: Unused, kept for Pydarknet compatibility.
+            nms: A float representing the NMS overlap threshold.
+            batch_size: An int representing the number of frames per pass.
+            top_k: Optional int bounding the number of results per image.
+            raw: A bool; when True, results are RESULT_DTYPE arrays.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A tuple (results, stats) laid out as Pydarknet.detect_batch.
+        """
+
+        net, meta, frames = model
+        start = time.perf_counter()
+        batch_size = max(1, int(batch_size))
+        options = {'thresh': thresh, 'nms': nms, 'top_k': top_k}
+        class_ids = None if classes is None else self.class_ids(meta, classes)
+
+        prepared = [self.prepare_frame(net, frame if isinstance(frame, np.ndarray)
+                                       else pdn.decode_image(frame))
+                    for frame in frames]
+
+        results = []
+        for index in range(0, len(prepared), batch_size):
+            chunk = prepared[index:index + batch_size]
+            rows = self._forward(net, np.stack([planes for planes, _ in chunk]))
+            for (_, geometry), image_rows in zip(chunk, rows):
+                res = self._detections(image_rows, net, options, class_ids)
+                results.append(pdn.format_results(
+                    meta, pdn.unletterbox(res, geometry), raw,
+                    class_ids is not None))
+
+        elapsed = time.perf_counter() - start
+        stats = {'images': len(frames),
+                 'passes': -(-len(frames) // batch_size),
+                 'total': elapsed,
+                 'per_image': elapsed / len(frames) if frames else 0.0}
+
+        return results, stats
@@ -2,10 +2,16 @@
 Module supporting the Detection class, responsible for running Darknet object
 detection and returning bounding boxes coordinates.
 
+function image_key: content key of an image, used to cache detections.
+
 class Detection: contains the builder the main detector functions.
 """
 
+import hashlib
+import collections
+
 import pydarknet #pylint: disable=import-error
+import numpy as np #pylint: disable=import-error
 import cv2 #pylint: disable=import-error
 
 import utils
@@ -35,36 +41,85 @@ def initialize_detector(config, weights, data):
 
 
 def initialize_image(img):
-    """Initialize the Darknet image.
+    """Initialize the image to process as a BGR frame.
+
+    In-memory frames are copied, so later writes by the caller to its
+    buffer cannot change the pixels behind the content key; encoded buffers
+    are decoded from memory and only paths touch the disk.
 
     Args:
-        img: A string representing the path of an image.
+        img: A string representing the path of an image, a HWC uint8 NumPy
+        array in BGR order, or a bytes-like object holding an encoded image.
 
     Returns:
-        An instance of a Darknet Image.
+        A tuple (frame, key): the HWC uint8 BGR frame and its content key,
+        or (None, None).
+
+    Raises:
+        ValueError: The image could not be read or decoded.
     """
 
     if img is None:
-        return None
+        return None, None
+
+    if isinstance(img, str):
+        frame = cv2.imread(img)
+    elif isinstance(img, np.ndarray):
+        frame = np.array(img, dtype=np.uint8, order='C', copy=True)
+    else:
+        frame = cv2.imdecode(np.frombuffer(img, dtype=np.uint8),
+                             cv2.IMREAD_COLOR)
+
+    if frame is None:
+        raise ValueError("cannot read image")
+
+    if frame.ndim == 2:
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+    frame = np.ascontiguousarray(frame, dtype=np.uint8)
+
+    return frame, image_key(frame)
+
+
+def image_key(frame):
+    """Content key of an image, used to cache detections.
 
-    image = pydarknet.Image(cv2.imread(img))
+    Args:
+        frame: A NumPy array holding the decoded image.
+
+    Returns:
+        A bytes digest identifying the image shape and pixels.
+    """
+
+    digest = hashlib.blake2b(str(frame.shape).encode(), digest_size=16)
+    digest.update(frame.tobytes())
 
-    return image
+    return digest.digest()
 
 
 class Detection():
     """Class responsible for running object detection on an image.
 
+    Raw detector outputs are cached per image content, so asking for
+    several labels, or setting an image again, does not run the network
+    again. The cache holds at most cache_size images, least recently used
+    first out. The Darknet Image wrapper is only built when the network
+    actually runs, once per image set.
+
     Attributes:
         detector: a Detector object representing the Darknet model.
         image: an Image object representing the image to be processed.
+        cache_size: an int representing the number of images cached.
     """
 
-    def __init__(self, config, weights, data, img):
+    def __init__(self, config, weights, data, img, cache_size=8): #pylint: disable=too-many-arguments
         """Initiates the builder for Detection"""
 
+        self.cache_size = cache_size
+        self._results = collections.OrderedDict()
         self._detector = initialize_detector(config, weights, data)
-        self._image = initialize_image(img)
+        self._image = None
+        self._frame, self._image_key = initialize_image(img)
 
 
     @property
@@ -95,6 +150,7 @@ class Detection():
         """
 
         self._detector = initialize_detector(config, weights, data)
+        self._results.clear()
 
 
     @property
@@ -105,9 +161,12 @@ class Detection():
             None
 
         Returns:
-            An Image object representing an image.
+            An Image object representing an image, or None.
         """
 
+        if self._image is None and self._frame is not None:
+            self._image = pydarknet.Image(self._frame)
+
         return self._image
 
 
@@ -116,13 +175,43 @@ class Detection():
         """Setter for Detection instance image.
 
         Args:
-            img: A string representing the path of an image.
+            img: A string representing the path of an image, a HWC uint8
+            NumPy array in BGR order, or a bytes-like object holding an
+            encoded image.
 
         Returns:
             None
         """
 
-        self._image = initialize_image(img)
+        self._image = None
+        self._frame, self._image_key = initialize_image(img)
+
+
+    def detect(self):
+        """Return the raw detector output for the current image.
+
+        The output is computed once per image content and cached.
+
+        Args:
+            None
+
+        Returns:
+            A list of (label, confidence, (x, y, width, height)) tuples, label
+            being bytes.
+        """
+
+        results = self._results.get(self._image_key)
+        if results is not None:
+            self._results.move_to_end(self._image_key)
+            return results
+
+        results = self.detector.detect(self.image)
+
+        self._results[self._image_key] = results
+        while len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+
+        return results
 
 
     def get_coordinates(self, label):
@@ -136,11 +225,28 @@ class Detection():
             the detected boundig boxes for the label.
         """
 
-        bounding_boxes = []
-        results = self.detector.detect(self.image)
+        label = label.encode('utf-8')
+
+        return [objects[2] for objects in self.detect() if objects[0] == label]
+
+
+    def get_coordinates_many(self, labels):
+        """Get bounding boxes coordinates for several labels at once.
+
+        All labels are answered from a single detection pass.
+
+        Args:
+            labels: An iterable of strings representing the labels to detect.
+
+        Returns:
+            A dict mapping each label to a list of (x, y, width, height)
+            tuples.
+        """
+
+        boxes = {label.encode('utf-8'): [] for label in labels}
 
-        for objects in results:
-            if objects[0].decode('utf-8') == label:
-                bounding_boxes.append(objects[2])
+        for objects in self.detect():
+            if objects[0] in boxes:
+                boxes[objects[0]].append(objects[2])
 
-        return bounding_boxes
+        return {label.decode('utf-8'): coords for label, coords in boxes.items()}
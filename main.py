@@ -3,10 +3,20 @@ Main handler for the catcher_rover server component.
 """
 
 import os
+import time
+import socket
+import asyncio
+import functools
+import itertools
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
+
 import utils
+import cvdnn
 import socks
+import workers
+import tracking
 import pydarknet as pdn
 
 
@@ -26,27 +36,42 @@ def init_environ():
                'inbox_loc':inbox_loc,
                'net':utils.init_environ_net(),
                'darknet':utils.init_environ_darknet(),
+               'archive':os.environ['CARO_ARCHIVE_FRAMES'] == 'True',
+               'server_mode':os.environ['CARO_SERVER_MODE'],
+               'inference_queue':int(os.environ['CARO_INFERENCE_QUEUE']),
+               'roi_tracking':os.environ['CARO_ROI_TRACKING'] == 'True',
+               'roi_expand':float(os.environ['CARO_ROI_EXPAND']),
+               'roi_refresh':int(os.environ['CARO_ROI_REFRESH']),
                'debug': os.environ['DEBUG']}
 
     return environ
 
 
-def darknet_model(cfg, weight, data):
+def darknet_model(cfg, weight, data, backend='darknet'):
     """Initialize Darknet model.
 
     Args:
         cfg: A string representing the cfg file path.
         weight: A string representing the weight file path.
         data: A string representing the data file path.
+        backend: A string selecting the inference backend: 'darknet' for
+        libdarknet.so, 'opencv' for cv2.dnn.
 
     Returns:
         A Darknet model tuple: (model, network, metadata).
+
+    Raises:
+        ValueError: The backend is unknown.
     """
 
+    if backend == 'opencv':
+        return cvdnn.load_model(cfg, weight, data)
+    if backend != 'darknet':
+        raise ValueError("unknown inference backend: %s" % backend)
+
     dark = pdn.Pydarknet('libdarknet.so')
 
-    load_network = dark.init_load_net()
-    network = load_network(cfg.encode(), weight.encode(), 0)
+    network = dark.load_network(cfg.encode(), weight.encode())
 
     load_metadata = dark.init_load_meta()
     metadata = load_metadata(data.encode())
@@ -54,22 +79,19 @@ def darknet_model(cfg, weight, data):
     return (dark, network, metadata)
 
 
-def compute_translation_vector(results, image):
+def compute_translation_vector(results, im_shape):
     """Compute and returns the pixel translation from center with input results.
 
     Args:
         results: A tuple including label, confidence level, and coordinate tuples
         from darknet output.
-        image: A string representing the path of an image to calculate the
-        translation vector from.
+        im_shape: A tuple including the image pixel width and height.
 
     Returns:
         A tuple containing the x_translation and y_translation pixel from image
         center.
     """
 
-    im_shape = utils.get_image_size(image)
-
     im_xcenter = int(im_shape[0] / 2)
     im_ycenter = int(im_shape[1] / 2)
 
@@ -82,60 +104,601 @@ def compute_translation_vector(results, image):
     return xcenter, ycenter
 
 
-def start_server():
-    """Runs the catcher_rover main loop."""
+def session_tracker(environ):
+    """Return a new per-session RoiTracker, or None when ROI is disabled.
 
-    environ = init_environ()
+    Args:
+        environ: A dictionary containing all environment variables.
+
+    Returns:
+        A tracking.RoiTracker instance or None.
+    """
+
+    if not environ['roi_tracking']:
+        return None
+
+    return tracking.RoiTracker(environ['roi_expand'], environ['roi_refresh'])
+
+
+def prepare_frame(model, view, tracker=None):
+    """Decode a received frame and letterbox it to the network size.
+
+    With a tracker, only the region around the last target is letterboxed,
+    unless the tracker asks for a full-frame pass. Full JPEG frames larger
+    than the network input are decoded at a reduced scale.
+
+    Args:
+        model: A Darknet model tuple: (model, network, metadata).
+        view: A bytes-like object holding the encoded frame.
+        tracker: Optional tracking.RoiTracker of the session.
+
+    Returns:
+        A tuple (prepared, im_shape, origin): the Pydarknet.prepare_frame
+        output, the encoded frame (width, height) and the (x, y, factor)
+        transform from processed pixels to frame pixels.
+    """
 
-    utils.init_logger(environ['debug'])
     logger = logging.getLogger('__main__')
-    logger.info("catcher_rover server - hello")
+    dark, network, _ = model
 
-    logger.info("initializing darknet model")
-    dark, network, metadata = darknet_model(environ['darknet']['cfg'],
-                                            environ['darknet']['weights'],
-                                            environ['darknet']['data'])
+    start = time.perf_counter()
+    im_shape = pdn.jpeg_size(view)
+    region = None
+    reduction = 1
+    if im_shape is not None:
+        region = None if tracker is None else tracker.region(*im_shape)
+        if region is None:
+            reduction = pdn.decode_reduction(*im_shape,
+                                             *dark.network_size(network))
 
-    logger.info("initializing server socket")
-    server_socket = socks.init_server_socket()
+    frame = pdn.decode_image(view, reduction)
+    if im_shape is None:
+        im_shape = (frame.shape[1], frame.shape[0])
+        region = None if tracker is None else tracker.region(*im_shape)
+    logger.info("frame decoded in %.2f ms, 1/%d scale",
+                1000 * (time.perf_counter() - start), reduction)
+
+    if region is None:
+        return (dark.prepare_frame(network, frame), im_shape,
+                (0, 0, im_shape[0] / frame.shape[1]))
+
+    x_0, y_0, x_1, y_1 = region
+    return (dark.prepare_frame(network, frame[y_0:y_1, x_0:x_1]), im_shape,
+            (x_0, y_0, 1.0))
+
+
+def infer_frame(model, prepared, classes=None, tracker=None):
+    """Run the detection on a prepared frame and compute its vector.
+
+    Args:
+        model: A Darknet model tuple: (model, network, metadata).
+        prepared: A tuple (prepared, im_shape, origin) as returned by
+        prepare_frame.
+        classes: Optional list of class indices to restrict the detection to.
+        tracker: Optional tracking.RoiTracker of the session, updated with
+        the box found.
+
+    Returns:
+        A (x, y) translation vector, or an empty list when nothing was
+        detected.
+    """
+
+    logger = logging.getLogger('__main__')
+    dark, network, metadata = model
+    prepared, im_shape, origin = prepared
+
+    results = dark.detect_prepared(network, metadata, prepared, top_k=1,
+                                   raw=True, classes=classes)
+    x_0, y_0, factor = origin
+    if factor != 1.0:
+        for field in ('x', 'y', 'w', 'h'):
+            results[field] *= factor
+    results['x'] += x_0
+    results['y'] += y_0
+
+    logger.info("darknet output: %s", str(results))
+
+    if not len(results): #pylint: disable=len-as-condition
+        if tracker is not None:
+            tracker.update(None)
+        return []
+
+    best = results[0]
+    if tracker is not None:
+        tracker.update((float(best['x']), float(best['y']),
+                        float(best['w']), float(best['h'])))
+    return compute_translation_vector(
+        (best['class_id'], best['prob'],
+         (best['x'], best['y'], best['w'], best['h'])),
+        im_shape)
+
+
+def detect_frame(model, view, classes=None, tracker=None):
+    """Decode a received frame and compute its translation vector.
+
+    Args:
+        model: A Darknet model tuple: (model, network, metadata).
+        view: A bytes-like object holding the encoded frame.
+        classes: Optional list of class indices to restrict the detection to.
+        tracker: Optional tracking.RoiTracker of the session.
+
+    Returns:
+        A (x, y) translation vector, or an empty list when nothing was
+        detected.
+    """
+
+    return infer_frame(model, prepare_frame(model, view, tracker), classes,
+                       tracker)
+
+
+def _receive_prepared(client, model, frame_buf, tracker):
+    """Receive one frame and prepare it, in the serve_session receiver.
+
+    Args:
+        client: A socket instance representing the client connection.
+        model: A Darknet model tuple: (model, network, metadata).
+        frame_buf: A socks.FrameBuffer instance receiving the frame bytes.
+        tracker: Optional tracking.RoiTracker of the session.
+
+    Returns:
+        A tuple (frame_id, view, prepared): prepared is the prepare_frame
+        output, or the exception it raised. (None, None, None) when the
+        client ended the session.
+    """
+
+    frame_id, view = socks.receive_frame(client, frame_buf)
+    if frame_id is None:
+        return None, None, None
+
+    try:
+        prepared = prepare_frame(model, view, tracker)
+    except Exception as err: #pylint: disable=broad-except
+        prepared = err
+
+    return frame_id, view, prepared
+
+
+def serve_session(client, model, inbox_loc, archive=False, classes=None, #pylint: disable=too-many-arguments,too-many-locals
+                  tracker=None):
+    """Serve frames from one client connection until the session ends.
+
+    Frames are received into two reusable in-memory buffers in turn and
+    decoded from there; nothing touches the filesystem unless archive is
+    set. A receiver thread receives and prepares frame N+1 while frame N is
+    inferred, so a tracker region lags the last box by one frame.
+
+    Args:
+        client: A socket instance representing the client connection.
+        model: A Darknet model tuple: (model, network, metadata).
+        inbox_loc: A string representing where archived frames are saved.
+        archive: A bool defining whether incoming frames are saved to disk.
+        classes: Optional list of class indices to restrict the detection to.
+        tracker: Optional tracking.RoiTracker of the session.
+
+    Returns:
+        An int representing the number of frames served.
+    """
+
+    logger = logging.getLogger('__main__')
+    frame_bufs = (socks.FrameBuffer(), socks.FrameBuffer())
+    receiver = ThreadPoolExecutor(max_workers=1)
+    served = 0
+
+    logger.info("receiving frames")
+    fetch = receiver.submit(_receive_prepared, client, model, frame_bufs[0],
+                            tracker)
+
+    try:
+        for count in itertools.count(1):
+            try:
+                frame_id, view, prepared = fetch.result()
+            except ConnectionError:
+                logger.warning("connection lost, ending session")
+                break
+            except socks.ProtocolError as err:
+                logger.warning("unsupported request, ending session: %s",
+                               str(err))
+                socks.send_error(client, 0, err)
+                break
+
+            if frame_id is None:
+                logger.info("session closed by client")
+                break
+
+            logger.info("frame %d received", frame_id)
+
+            # The other buffer is free: its frame was answered last round.
+            fetch = receiver.submit(_receive_prepared, client, model,
+                                    frame_bufs[count % 2], tracker)
+
+            if archive:
+                socks.save_frame(view, inbox_loc, frame_id)
+
+            logger.info("starting label detection")
+
+            try:
+                if isinstance(prepared, Exception):
+                    raise prepared
+                results = infer_frame(model, prepared, classes, tracker)
+            except Exception as err: #pylint: disable=broad-except
+                logger.exception("label detection failed")
+                socks.send_error(client, frame_id, err)
+                continue
+
+            logger.info("frame processing completed")
+
+            logger.info("sending bounding boxes")
+            logger.info("bounding box values: %s", str(results))
+            socks.send_result(client, frame_id, results)
+            served += 1
+
+            logger.info("results sent")
+    finally:
+        if not fetch.done():
+            # Wake the receiver blocked on a connection being abandoned.
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        receiver.shutdown()
+
+    return served
+
+
+async def serve_datagrams(client, send_lock, token, model, infer, datagrams): #pylint: disable=too-many-arguments
+    """Serve the datagram frames of one client until cancelled.
+
+    Only the newest complete frame is processed; results go back over the
+    client connection.
+
+    Args:
+        client: A non-blocking socket representing the client connection.
+        send_lock: An asyncio.Lock held while sending on client.
+        token: An int representing the session token the client announced.
+        model: A Darknet model tuple: (model, network, metadata).
+        infer: A coroutine function (model, view) returning a result.
+        datagrams: A socks.AsyncDatagramFrames endpoint.
+
+    Returns:
+        None
+    """
+
+    logger = logging.getLogger('__main__')
+    loop = asyncio.get_running_loop()
+
+    while True:
+        frame_id, frame = await datagrams.next_frame(token)
+
+        try:
+            results = await infer(model, frame)
+        except Exception as err: #pylint: disable=broad-except
+            logger.exception("label detection failed")
+            async with send_lock:
+                await socks.async_send_error(loop, client, frame_id, err)
+            continue
+
+        async with send_lock:
+            await socks.async_send_result(loop, client, frame_id, results)
+
+
+async def _answer_frame(loop, client, send_lock, frame_id, task, #pylint: disable=too-many-arguments
+                        previous=None):
+    """Wait for the inference task of a frame and send its outcome.
+
+    Args:
+        loop: The running asyncio event loop.
+        client: A non-blocking socket representing the client connection.
+        send_lock: An asyncio.Lock held while sending on client.
+        frame_id: An int identifying the frame.
+        task: An asyncio.Task resolving to the frame result.
+        previous: Optional _answer_frame task of the previous frame, awaited
+        first so results go out in order.
+
+    Returns:
+        An int: 1 when a result was sent, 0 when an error was sent.
+    """
+
+    logger = logging.getLogger('__main__')
+
+    if previous is not None:
+        await previous
+
+    try:
+        results = await task
+    except Exception as err: #pylint: disable=broad-except
+        logger.exception("label detection failed")
+        async with send_lock:
+            await socks.async_send_error(loop, client, frame_id, err)
+        return 0
+
+    logger.info("bounding box values: %s", str(results))
+    async with send_lock:
+        await socks.async_send_result(loop, client, frame_id, results)
+
+    return 1
+
+
+async def serve_session_async(client, model, infer, archive_loc=None, #pylint: disable=too-many-arguments,too-many-branches
+                              datagrams=None):
+    """Serve frames from one non-blocking client connection.
+
+    Connection I/O runs on the event loop, so a slow uplink only delays its
+    own session. Inference is handed to infer, which runs it off the loop.
+    Frames are received into two buffers in turn: frame N+1 is received,
+    and its inference started, while frame N is still being inferred. A
+    buffer is reused once the answer for its previous frame is sent.
+    A client announcing a datagram session token gets its datagram frames
+    served by a serve_datagrams task for the rest of the session. Every
+    send on the connection holds a per-session lock, so messages from the
+    answer and datagram tasks never interleave.
+
+    Args:
+        client: A non-blocking socket representing the client connection.
+        model: A Darknet model tuple: (model, network, metadata).
+        infer: A coroutine function (model, view) returning a result.
+        archive_loc: Optional string representing the per-client folder
+        where frames are archived.
+        datagrams: Optional socks.AsyncDatagramFrames endpoint.
+
+    Returns:
+        An int representing the number of frames served.
+    """
+
+    logger = logging.getLogger('__main__')
+    loop = asyncio.get_running_loop()
+    frame_bufs = (socks.FrameBuffer(), socks.FrameBuffer())
+    send_lock = asyncio.Lock()
+    received = 0
+    served = 0
+    token = None
+    datagram_task = None
+    # _answer_frame task of the last frame received into each buffer.
+    answers = [None, None]
+    connected = True
+
+    try:
+        while True:
+            if answers[received % 2] is not None:
+                served += await answers[received % 2]
+                answers[received % 2] = None
+
+            try:
+                msg_type, frame_id, view = await socks.async_receive_message(
+                    loop, client, frame_bufs[received % 2])
+            except ConnectionError:
+                logger.warning("connection lost, ending session")
+                connected = False
+                break
+            except socks.ProtocolError as err:
+                logger.warning("unsupported request, ending session: %s",
+                               str(err))
+                async with send_lock:
+                    await socks.async_send_error(loop, client, 0, err)
+                break
+
+            if msg_type == socks.MSG_BYE:
+                logger.info("session closed by client")
+                break
+
+            if (msg_type == socks.MSG_HELLO and datagrams is not None
+                    and datagram_task is None
+                    and len(view) == socks.HELLO.size):
+                token = socks.HELLO.unpack(view)[0]
+                logger.info("serving datagram frames of session %08x",
+                            token)
+                datagrams.register(token)
+                datagram_task = loop.create_task(
+                    serve_datagrams(client, send_lock, token, model, infer,
+                                    datagrams))
+                continue
+
+            if msg_type != socks.MSG_FRAME:
+                async with send_lock:
+                    await socks.async_send_error(loop, client, frame_id,
+                                                 "unexpected message type %d"
+                                                 % msg_type)
+                continue
+
+            if archive_loc is not None:
+                socks.save_frame(view, archive_loc, frame_id)
+
+            answers[received % 2] = loop.create_task(_answer_frame(
+                loop, client, send_lock, frame_id,
+                loop.create_task(infer(model, view)),
+                answers[(received + 1) % 2]))
+            received += 1
+
+        for index in (received % 2, (received + 1) % 2):
+            if answers[index] is not None and connected:
+                served += await answers[index]
+                answers[index] = None
+    finally:
+        for answer in answers:
+            if answer is not None:
+                answer.cancel()
+        if datagram_task is not None:
+            datagram_task.cancel()
+            stats = datagrams.unregister(token)
+            logger.info("%d datagram frames completed, %d dropped incomplete",
+                        stats.completed, stats.dropped)
+
+    return served
+
+
+def serve_forever(server_socket, model, environ):
+    """Serve clients one at a time, each over a persistent session.
+
+    Args:
+        server_socket: A listening socket instance.
+        model: A Darknet model tuple: (model, network, metadata).
+        environ: A dictionary containing all environment variables.
+
+    Returns:
+        None
+    """
+
+    logger = logging.getLogger('__main__')
 
     while True:
-        server_socket.listen(5)
         logger.info("waiting for incoming connections")
         client, addr = server_socket.accept()
         logger.info("incoming connection from %s", str(addr))
 
-        logger.info("receiving frames")
+        tracker = session_tracker(environ)
 
-        frame_size = int(socks.receive_bytes_to_string(client))
-        socks.send_msg(client, 'OK FRAME')
-        socks.receive_frame(client, frame_size, environ['inbox_loc'])
-        logger.info("frame received")
+        try:
+            socks.send_info(client, environ['input_size'])
+            served = serve_session(client, model, environ['inbox_loc'],
+                                   environ['archive'], environ['classes'],
+                                   tracker)
+            logger.info("%d frames served for %s", served, str(addr))
+        except OSError:
+            logger.exception("session with %s failed", str(addr))
 
-        logger.info("starting label detection")
+        if tracker is not None:
+            logger.info("%d full-frame passes, %d ROI passes",
+                        tracker.full_count, tracker.roi_count)
 
-        image = os.path.join(environ['inbox_loc'], "frame.jpg")
-        results = dark.detect((network, metadata, image.encode()))
+        logger.info("native darknet allocations: %s",
+                    str(model[0].native_allocations()))
+        logger.info("closing sockets")
+        client.close()
 
-        logger.info("darknet output: %s", str(results))
 
-        if results:
-            results = compute_translation_vector(results[0], image)
+async def serve_forever_async(server_socket, model, environ, pool=None):
+    """Serve many clients concurrently from an asyncio event loop.
 
-        logger.info("sending frame received ack")
-        socks.send_msg(client, 'OK FRAME')
+    Darknet runs in a single worker thread, or in the worker processes of
+    pool when given. Without pool, frames are decoded and letterboxed in a
+    separate preprocessing thread, overlapping the inference of earlier
+    frames, and sessions get ROI inference when enabled; pool workers hold
+    no session state, so ROI is not used with them. At most inference_queue
+    frames wait for inference at once; other sessions keep receiving
+    meanwhile. Datagram frames are received on socks.DATAGRAM_PORT.
 
-        logger.info("frame processing completed")
+    Args:
+        server_socket: A listening socket instance.
+        model: A Darknet model tuple: (model, network, metadata).
+        environ: A dictionary containing all environment variables.
+        pool: Optional started workers.WorkerPool running detect_frame.
 
-        logger.info("sending bounding boxes")
-        logger.info("bounding box values: %s", str(results))
-        socks.waiting_for_ack(client, "VECT")
-        socks.send_msg(client, results)
+    Returns:
+        None
+    """
 
-        logger.info("results sent")
+    logger = logging.getLogger('__main__')
+    loop = asyncio.get_running_loop()
+    pending = asyncio.Semaphore(environ['inference_queue'])
+    sessions = set()
+
+    if pool is None:
+        executor = ThreadPoolExecutor(max_workers=1)
+        preprocessor = ThreadPoolExecutor(max_workers=1)
+
+        async def infer(model, view, tracker=None):
+            async with pending:
+                prepared = await loop.run_in_executor(preprocessor,
+                                                      prepare_frame, model,
+                                                      view, tracker)
+                return await loop.run_in_executor(executor, infer_frame,
+                                                  model, prepared,
+                                                  environ['classes'], tracker)
+    else:
+        async def infer(_model, view, tracker=None): #pylint: disable=unused-argument
+            async with pending:
+                return await asyncio.wrap_future(pool.submit(view))
+
+    async def handle(client, addr):
+        archive_loc = None
+        if environ['archive']:
+            archive_loc = os.path.join(environ['inbox_loc'], "%s_%d" % addr)
+            os.makedirs(archive_loc, exist_ok=True)
+
+        tracker = session_tracker(environ) if pool is None else None
+
+        try:
+            await socks.async_send_info(loop, client, environ['input_size'])
+            served = await serve_session_async(
+                client, model, functools.partial(infer, tracker=tracker),
+                archive_loc, datagrams)
+            logger.info("%d frames served for %s", served, str(addr))
+            if tracker is not None:
+                logger.info("%d full-frame passes, %d ROI passes",
+                            tracker.full_count, tracker.roi_count)
+        except OSError:
+            logger.exception("session with %s failed", str(addr))
+        finally:
+            client.close()
+            if pool is None:
+                logger.info("native darknet allocations: %s",
+                            str(model[0].native_allocations()))
+
+    server_socket.setblocking(False)
+
+    _, datagrams = await loop.create_datagram_endpoint(
+        socks.AsyncDatagramFrames,
+        sock=socks.init_datagram_socket(server_socket.getsockname()[0],
+                                        socks.DATAGRAM_PORT))
 
-        logger.info("closing sockets")
-        client.close()
+    while True:
+        client, addr = await loop.sock_accept(server_socket)
+        client.setblocking(False)
+        logger.info("incoming connection from %s", str(addr))
+
+        task = loop.create_task(handle(client, addr))
+        sessions.add(task)
+        task.add_done_callback(sessions.discard)
+
+
+def start_server():
+    """Runs the catcher_rover main loop."""
+
+    environ = init_environ()
+
+    utils.init_logger(environ['debug'])
+    logger = logging.getLogger('__main__')
+    logger.info("catcher_rover server - hello")
+
+    logger.info("initializing darknet model, %s backend",
+                environ['darknet']['backend'])
+    model = darknet_model(environ['darknet']['cfg'],
+                          environ['darknet']['weights'],
+                          environ['darknet']['data'],
+                          environ['darknet']['backend'])
+
+    environ['input_size'] = model[0].network_size(model[1])
+    logger.info("network input size: %s", str(environ['input_size']))
+
+    environ['classes'] = model[0].class_ids(model[2],
+                                            [environ['darknet']['label']])
+    logger.info("detecting label %s, class %d", environ['darknet']['label'],
+                environ['classes'][0])
+
+    logger.info("initializing server socket")
+    server_socket = socks.init_server_socket()
+    server_socket.listen(5)
+
+    if environ['server_mode'] == 'async' and environ['darknet']['workers'] > 1:
+        logger.info("serving clients concurrently with %d workers",
+                    environ['darknet']['workers'])
+        environ['inference_queue'] = max(environ['inference_queue'],
+                                         environ['darknet']['workers'])
+        with workers.WorkerPool(functools.partial(detect_frame,
+                                                  classes=environ['classes']),
+                                model,
+                                environ['darknet']['workers'],
+                                slot_count=environ['inference_queue']) as pool:
+            asyncio.run(serve_forever_async(server_socket, model, environ,
+                                            pool))
+    elif environ['server_mode'] == 'async':
+        logger.info("serving clients concurrently")
+        asyncio.run(serve_forever_async(server_socket, model, environ))
+    else:
+        if environ['darknet']['workers'] > 1:
+            logger.warning("CARO_DARKNET_WORKERS=%d ignored: the worker pool "
+                           "requires CARO_SERVER_MODE=async",
+                           environ['darknet']['workers'])
+        serve_forever(server_socket, model, environ)
 
 
 if __name__ == '__main__':
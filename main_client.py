@@ -6,8 +6,6 @@ import os
 import logging
 import time
 
-from ast import literal_eval
-
 import utils
 import camera
 import net
@@ -28,6 +26,12 @@ def init_environ():
     environ = {'capture_loc':utils.init_environ_folder(),
                'net':utils.init_environ_net(),
                'darknet':utils.init_environ_darknet(),
+               'pipeline_depth':int(os.environ['CARO_PIPELINE_DEPTH']),
+               'transport':os.environ['CARO_TRANSPORT'],
+               'datagram_rate':int(os.environ['CARO_DATAGRAM_RATE']) or None,
+               'change_threshold':float(os.environ['CARO_CHANGE_THRESHOLD']),
+               'jpeg':{'quality':int(os.environ['CARO_JPEG_QUALITY']),
+                       'subsampling':os.environ['CARO_JPEG_SUBSAMPLING']},
                'debug':os.environ['DEBUG']}
 
     return environ
@@ -75,6 +79,171 @@ def run_cloud_command(remote_ip, username, keyfile, command, retry=10):
     return (connection, connection.exec_command(command))
 
 
+def steer_rover(rove, vector, hold=True):
+    """Steer the rover toward a translation vector.
+
+    Args:
+        rove: A Rover instance to steer.
+        vector: A (x, y) tuple, or None when nothing was detected.
+        hold: A bool; when True, override for rove.rest_time then release,
+        otherwise keep the override until the next call.
+
+    Returns:
+        None
+    """
+
+    logger = logging.getLogger('run_catcher_rover')
+
+    if not vector:
+        logger.warning("no detection for this frame")
+        if not hold:
+            rove.channel_override(0, 0)
+        return
+
+    logger.info("vector: xval: %s yval: %s", str(vector[0]), str(vector[1]))
+    logger.info("moving rover: %s", str(1500 + vector[0]))
+    rove.channel_override(vector[0], 0)
+
+    if hold:
+        time.sleep(rove.rest_time)
+        rove.channel_override(0, 0)
+
+
+def scale_vector(vector, scale):
+    """Map a translation vector back to original frame coordinates.
+
+    Args:
+        vector: A (x, y) tuple computed on the uploaded frame, or None.
+        scale: A float representing the factor applied before upload.
+
+    Returns:
+        A (x, y) tuple in original frame pixels, or None.
+    """
+
+    if not vector or scale == 1.0:
+        return vector
+
+    return round(vector[0] / scale), round(vector[1] / scale)
+
+
+def stream_frames(session, cam, rove, detector, iterations=15, jpeg=None): #pylint: disable=too-many-arguments
+    """Capture frames and steer the rover in stop-and-wait mode.
+
+    Frames the change detector deems unchanged are not uploaded; the last
+    translation vector is reused instead. Frames are encoded in memory and
+    never written to disk.
+
+    Args:
+        session: A connected socks.ClientSession.
+        cam: A Camera instance used for captures.
+        rove: A Rover instance to steer.
+        detector: A camera.ChangeDetector instance.
+        iterations: An int representing the number of frames to process.
+        jpeg: Optional dict with the quality and subsampling to encode with.
+
+    Returns:
+        None
+    """
+
+    logger = logging.getLogger('run_catcher_rover')
+    jpeg = jpeg or {}
+    recv_vect = None
+
+    for count in range(iterations):
+
+        logger.info("iteration %s, capturing frame", str(count))
+        frm = cam.capture(save=False)
+        logger.info("frame captured")
+
+        if not detector.changed(frm):
+            logger.info("frame unchanged, reusing last vector")
+            steer_rover(rove, recv_vect)
+            continue
+
+        logger.info("sending frame")
+        frame, scale = cam.encode(frm, size=session.input_size,
+                                  **jpeg).result()
+        if not cam.intact():
+            logger.warning("frame overwritten while encoding, not uploaded")
+            continue
+
+        try:
+            _, recv_vect = session.exchange(frame, count)
+        except socks.ProtocolError as err:
+            logger.error("server error: %s", str(err))
+            recv_vect = None
+
+        logger.info("vector received")
+
+        recv_vect = scale_vector(recv_vect, scale)
+        steer_rover(rove, recv_vect)
+
+    logger.info("%d frames uploaded, %d unchanged frames skipped",
+                detector.changed_count, detector.skipped_count)
+
+
+def stream_frames_pipelined(session, cam, rove, detector, iterations=15, #pylint: disable=too-many-arguments
+                            jpeg=None):
+    """Capture frames and steer the rover with several frames in flight.
+
+    The loop never waits for a given frame's result: it steers from the
+    newest result available, stale results being dropped by the session.
+    Frames the change detector deems unchanged are not uploaded. Frames are
+    encoded in memory, in the camera encoder thread, while the loop steers
+    from the latest result.
+
+    Args:
+        session: A connected socks.PipelinedSession or DatagramSession.
+        cam: A Camera instance used for captures.
+        rove: A Rover instance to steer.
+        detector: A camera.ChangeDetector instance.
+        iterations: An int representing the number of frames to process.
+        jpeg: Optional dict with the quality and subsampling to encode with.
+
+    Returns:
+        None
+    """
+
+    logger = logging.getLogger('run_catcher_rover')
+    jpeg = jpeg or {}
+    scales = {}
+
+    for count in range(iterations):
+
+        logger.info("iteration %s, capturing frame", str(count))
+        frm = cam.capture(save=False)
+
+        encoding = None
+        if detector.changed(frm):
+            encoding = cam.encode(frm, size=session.input_size, **jpeg)
+        else:
+            logger.info("frame %d unchanged, not uploaded", count)
+
+        result = session.latest()
+        if result is not None:
+            logger.info("result for frame %d received", result[0])
+            steer_rover(rove, scale_vector(result[1], scales[result[0]]),
+                        hold=False)
+            for frame_id in [key for key in scales if key <= result[0]]:
+                del scales[frame_id]
+
+        if encoding is not None:
+            frame, scale = encoding.result()
+            if not cam.intact():
+                logger.warning("frame %d overwritten while encoding, "
+                               "not uploaded", count)
+                continue
+            scales[count] = scale
+            session.submit(frame, count)
+            logger.info("frame %d in flight", count)
+
+    rove.channel_override(0, 0)
+    logger.info("%d stale results dropped, %d server errors",
+                session.stale, session.errors)
+    logger.info("%d frames uploaded, %d unchanged frames skipped",
+                detector.changed_count, detector.skipped_count)
+
+
 def run_catcher_rover():
     """Runs the catcher_rover main loop."""
 
@@ -113,48 +282,30 @@ def run_catcher_rover():
     rove = rover.Rover('/dev/ttyACM0', sleep=1.5)
     rove.change_rover_mode('MANUAL')
 
+    detector = camera.ChangeDetector(environ['change_threshold'])
+
     logger.info("connecting to instance %s", environ['net']['nets']['ips'])
 
     time.sleep(15)
 
-    for count in range(15):
-
-        client_socket = socks.init_client_socket(str(environ['net']['nets']['ips']))
-
-        logger.info("iteration %s, capturing frame", str(count))
-        cam.capture()
-        logger.info("frame captured")
-
-        logger.info("sending frame")
-        frame_loc = os.path.join(environ['capture_loc'] + "frame.jpg")
-        socks.send_frame_size(client_socket, frame_loc)
-        socks.waiting_for_ack(client_socket)
-        socks.send_frame(client_socket, frame_loc)
-        logger.info("waiting for frame reception")
-        socks.waiting_for_ack(client_socket)
-
-        logger.info("frame sent")
-
-        logger.info("receiving vector")
-
-        socks.send_msg(client_socket, "OK VECT")
-        recv_string = socks.receive_bytes_to_string(client_socket)
-        os.remove(frame_loc)
-
-        logger.info("vector received")
-
-        if recv_string != "[]":
-
-            recv_vect = literal_eval(recv_string)
-            logger.info("vector: xval: %s yval: %s",
-                        str(recv_vect[0]), str(recv_vect[1]))
-            logger.info("moving rover: %s", str(1500 + recv_vect[0]))
-            rove.channel_override(recv_vect[0], 0)
-            time.sleep(rove.rest_time)
-            rove.channel_override(0, 0)
-
+    with cam:
+        if environ['transport'] == 'udp':
+            with socks.DatagramSession(
+                    str(environ['net']['nets']['ips']),
+                    rate=environ['datagram_rate']) as session:
+                stream_frames_pipelined(session, cam, rove, detector,
+                                        jpeg=environ['jpeg'])
+        elif environ['pipeline_depth'] > 1:
+            with socks.PipelinedSession(
+                    str(environ['net']['nets']['ips']),
+                    depth=environ['pipeline_depth']) as session:
+                stream_frames_pipelined(session, cam, rove, detector,
+                                        jpeg=environ['jpeg'])
         else:
-            logger.warning("no detection for this frame")
+            with socks.ClientSession(
+                    str(environ['net']['nets']['ips'])) as session:
+                stream_frames(session, cam, rove, detector,
+                              jpeg=environ['jpeg'])
 
     cloud.delete_instance()
 
@@ -5,6 +5,12 @@ function sample: get a sample from a probability distribution.
 
 function c_array: returns a c-type array from a list of values.
 
+function decode_image: decode an encoded image buffer into a BGR array.
+
+function jpeg_size: read the size of a JPEG image from its frame header.
+
+function decode_reduction: pick a JPEG decode reduction for a network size.
+
 class BOX: C-style struct representing a x-y box.
 
 class DETECTION: C-style struct representing a detection item.
@@ -13,14 +19,30 @@ class IMAGES: C-style struct representing an image.
 
 class METADATA: C-style struct representing model metadata.
 
+function cfg_net_options: read the [net] section of a cfg file.
+
+function format_results: format detection results as tuples or raw records.
+
+class DarknetApi: Immutable table of configured Darknet functions.
+
+class ImagePool: Reusable Darknet images, keyed by resolution.
+
 class pydarknet: Darknet wrapper for python class.
 """
 
 #pylint: disable=too-few-public-methods
 
 
+import time
 import ctypes
 import random
+import threading
+import functools
+import contextlib
+import collections
+
+import numpy as np #pylint: disable=import-error
+import cv2 #pylint: disable=import-error
 
 
 def sample(probs):
@@ -64,6 +86,91 @@ def c_array(ctype, values):
     return arr
 
 
+_REDUCED_DECODE_FLAGS = {1: cv2.IMREAD_COLOR,
+                         2: cv2.IMREAD_REDUCED_COLOR_2,
+                         4: cv2.IMREAD_REDUCED_COLOR_4,
+                         8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def decode_image(buf, reduction=1):
+    """Decode an encoded image buffer into a BGR array.
+
+    Args:
+        buf: A bytes-like object holding an encoded (e.g. JPEG) image.
+        reduction: An int among 1, 2, 4 and 8; JPEG images are then decoded
+        at 1/reduction of their size, in the DCT domain.
+
+    Returns:
+        A HWC uint8 NumPy array in BGR order.
+
+    Raises:
+        ValueError: The buffer could not be decoded.
+    """
+
+    frame = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8),
+                         _REDUCED_DECODE_FLAGS[reduction])
+    if frame is None:
+        raise ValueError("cannot decode image buffer")
+
+    return frame
+
+
+def jpeg_size(buf):
+    """Read the size of a JPEG image from its frame header.
+
+    Args:
+        buf: A bytes-like object holding an encoded image.
+
+    Returns:
+        A (width, height) tuple, or None when buf is not a JPEG image.
+    """
+
+    data = memoryview(buf).cast('B')
+    if data[:2] != b'\xff\xd8':
+        return None
+
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xff:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xff:
+            pos += 1
+            continue
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            return ((data[pos + 7] << 8) | data[pos + 8],
+                    (data[pos + 5] << 8) | data[pos + 6])
+        pos += 2 + ((data[pos + 2] << 8) | data[pos + 3])
+
+    return None
+
+
+def decode_reduction(src_width, src_height, net_width, net_height):
+    """Pick the largest JPEG decode reduction that keeps network detail.
+
+    The reduced frame must still be at least as large as its letterboxed
+    copy, so reduced decoding never makes the network input blurrier.
+
+    Args:
+        src_width: An int representing the encoded frame width.
+        src_height: An int representing the encoded frame height.
+        net_width: An int representing the network input width.
+        net_height: An int representing the network input height.
+
+    Returns:
+        An int among 1, 2, 4 and 8, to pass to decode_image.
+    """
+
+    geometry = letterbox_geometry(src_width, src_height, net_width, net_height)
+
+    for reduction in (8, 4, 2):
+        if (src_width // reduction >= geometry.width
+                and src_height // reduction >= geometry.height):
+            return reduction
+
+    return 1
+
+
 class BOX(ctypes.Structure):
     """C-style struct representing a x-y box."""
 
@@ -100,6 +207,319 @@ class METADATA(ctypes.Structure):
                 ("names", ctypes.POINTER(ctypes.c_char_p))]
 
 
+def cfg_net_options(cfg):
+    """Read the [net] section options of a Darknet cfg file.
+
+    Args:
+        cfg: A string representing the cfg file path.
+
+    Returns:
+        A dict mapping [net] option names to their string values.
+    """
+
+    options = {}
+    section = None
+    with open(cfg) as cfg_file:
+        for line in cfg_file:
+            line = line.split('#', 1)[0].strip()
+            if line.startswith('[') and section == '[net]':
+                break
+            if line.startswith('['):
+                section = line
+            elif '=' in line and section == '[net]':
+                key, value = line.split('=', 1)
+                options[key.strip()] = value.strip()
+
+    return options
+
+
+# NumPy mirror of the DETECTION layout; the prob pointer is read as an
+# address so the whole array can be viewed without per-field ctypes access.
+_DETECTION_DTYPE = np.dtype({
+    'names': ['x', 'y', 'w', 'h', 'prob'],
+    'formats': [np.float32] * 4 + [np.uintp],
+    'offsets': [DETECTION.bbox.offset + BOX.x.offset,
+                DETECTION.bbox.offset + BOX.y.offset,
+                DETECTION.bbox.offset + BOX.w.offset,
+                DETECTION.bbox.offset + BOX.h.offset,
+                DETECTION.prob.offset],
+    'itemsize': ctypes.sizeof(DETECTION)})
+
+RESULT_DTYPE = np.dtype([('class_id', np.int32), ('prob', np.float32),
+                         ('x', np.float32), ('y', np.float32),
+                         ('w', np.float32), ('h', np.float32)])
+
+
+def extract_detections(dets, num, classes, top_k=None, class_ids=None):
+    """Vectorized extraction of a DETECTION array.
+
+    Every (detection, class) pair with a positive probability becomes one
+    result record. The DETECTION array and each prob array are viewed as
+    NumPy arrays; no per-class ctypes access happens.
+
+    Args:
+        dets: A POINTER(DETECTION) as returned by get_network_boxes.
+        num: An int representing the number of detections.
+        classes: An int representing the number of classes.
+        top_k: Optional int bounding the number of results kept.
+        class_ids: Optional sequence of class indices; other classes are
+        not inspected.
+
+    Returns:
+        A RESULT_DTYPE structured array sorted by decreasing probability.
+    """
+
+    if num == 0:
+        return np.empty(0, dtype=RESULT_DTYPE)
+
+    raw = np.ctypeslib.as_array(ctypes.cast(dets, ctypes.POINTER(ctypes.c_ubyte)),
+                                shape=(num * ctypes.sizeof(DETECTION),))
+    raw = raw.view(_DETECTION_DTYPE)
+
+    prob_array = ctypes.c_float * classes
+    probs = [np.frombuffer(prob_array.from_address(int(addr)), dtype=np.float32)
+             for addr in raw['prob']]
+
+    if class_ids is None:
+        probs = np.stack(probs)
+    else:
+        class_ids = np.asarray(class_ids, dtype=np.int32)
+        probs = np.stack([prob[class_ids] for prob in probs])
+
+    det_idx, class_idx = np.nonzero(probs > 0)
+    scores = probs[det_idx, class_idx]
+
+    if top_k is not None and top_k < len(scores):
+        keep = np.argpartition(-scores, top_k - 1)[:top_k]
+        det_idx, class_idx, scores = det_idx[keep], class_idx[keep], scores[keep]
+
+    order = np.argsort(-scores, kind='stable')
+
+    if class_ids is not None:
+        class_idx = class_ids[class_idx]
+
+    res = np.empty(len(order), dtype=RESULT_DTYPE)
+    res['class_id'] = class_idx[order]
+    res['prob'] = scores[order]
+    for field in ('x', 'y', 'w', 'h'):
+        res[field] = raw[field][det_idx[order]]
+
+    return res
+
+
+def format_results(meta, res, raw, ids=False):
+    """Format a RESULT_DTYPE array as the detect methods return it.
+
+    Args:
+        meta: A meta object representing the model metadata.
+        res: A RESULT_DTYPE structured array.
+        raw: A bool; when True, res is returned as is.
+        ids: A bool; when True, tuples carry the int class id instead of
+        the class name.
+
+    Returns:
+        res when raw, a list of (name, prob, (x, y, w, h)) tuples otherwise.
+    """
+
+    if raw:
+        return res
+
+    if ids:
+        return [(int(rec['class_id']), float(rec['prob']),
+                 (float(rec['x']), float(rec['y']),
+                  float(rec['w']), float(rec['h'])))
+                for rec in res]
+
+    return [(meta.names[rec['class_id']], float(rec['prob']),
+             (float(rec['x']), float(rec['y']),
+              float(rec['w']), float(rec['h'])))
+            for rec in res]
+
+
+DarknetApi = collections.namedtuple('DarknetApi', [
+    'load_image', 'make_image', 'free_image', 'predict_image',
+    'network_predict', 'set_batch_network', 'get_network_boxes', 'do_nms_obj',
+    'free_detections', 'network_width', 'network_height'])
+DarknetApi.__doc__ = """Immutable table of configured Darknet functions.
+
+Resolved once per Pydarknet instance, so the per-frame paths neither look
+symbols up nor reassign their argtypes/restype.
+"""
+
+
+Letterbox = collections.namedtuple('Letterbox', [
+    'scale', 'dx', 'dy', 'width', 'height'])
+Letterbox.__doc__ = """Letterbox transform from a source resolution to the network.
+
+The source is resized by scale to width x height, then pasted at (dx, dy)
+in a gray network-sized canvas, as Darknet letterbox_image does.
+"""
+
+
+@functools.lru_cache(maxsize=32)
+def letterbox_geometry(src_width, src_height, net_width, net_height):
+    """Compute the letterbox transform of a source resolution.
+
+    Results are cached, so the geometry is only computed once per source
+    resolution.
+
+    Args:
+        src_width: An int representing the source frame width.
+        src_height: An int representing the source frame height.
+        net_width: An int representing the network input width.
+        net_height: An int representing the network input height.
+
+    Returns:
+        A Letterbox tuple.
+    """
+
+    scale = min(net_width / src_width, net_height / src_height)
+    width = min(net_width, max(1, int(round(src_width * scale))))
+    height = min(net_height, max(1, int(round(src_height * scale))))
+
+    return Letterbox(scale, (net_width - width) // 2,
+                     (net_height - height) // 2, width, height)
+
+
+def letterbox_frame(frame, net_width, net_height):
+    """Letterbox a BGR array to the network size.
+
+    The frame is resized once, then converted straight into normalized RGB
+    planes laid out as a Darknet image expects.
+
+    Args:
+        frame: A HWC (or HW grayscale) uint8 NumPy array in BGR order.
+        net_width: An int representing the network input width.
+        net_height: An int representing the network input height.
+
+    Returns:
+        A tuple (planes, geometry), planes being a CHW float32 array of the
+        network size and geometry the Letterbox tuple used.
+    """
+
+    geometry = letterbox_geometry(frame.shape[1], frame.shape[0],
+                                  net_width, net_height)
+
+    resized = frame
+    if (geometry.width, geometry.height) != (frame.shape[1], frame.shape[0]):
+        resized = cv2.resize(frame, (geometry.width, geometry.height),
+                             interpolation=cv2.INTER_LINEAR)
+    if resized.ndim == 2:
+        resized = resized[:, :, np.newaxis]
+
+    planes = np.full((resized.shape[2], net_height, net_width), 0.5,
+                     dtype=np.float32)
+    np.multiply(resized.transpose(2, 0, 1)[::-1], np.float32(1 / 255.0),
+                out=planes[:, geometry.dy:geometry.dy + geometry.height,
+                           geometry.dx:geometry.dx + geometry.width],
+                casting='unsafe')
+
+    return planes, geometry
+
+
+def unletterbox(res, geometry):
+    """Map network boxes back to source frame pixels, in place.
+
+    Args:
+        res: A RESULT_DTYPE structured array in network pixels.
+        geometry: The Letterbox tuple the frame was prepared with.
+
+    Returns:
+        res, in source frame pixels.
+    """
+
+    res['x'] = (res['x'] - geometry.dx) / geometry.scale
+    res['y'] = (res['y'] - geometry.dy) / geometry.scale
+    res['w'] /= geometry.scale
+    res['h'] /= geometry.scale
+
+    return res
+
+
+class ImagePool():
+    """Reusable Darknet images, keyed by resolution.
+
+    Images are allocated with make_image the first time a resolution is
+    seen, then handed out again for later frames of the same resolution.
+    Images are always returned to the pool, or freed, when the acquire
+    context exits, even on error.
+
+    Attributes:
+        keep: An int representing the idle images kept per resolution.
+        allocated: An int counting the images currently allocated.
+        in_use: An int counting the images currently handed out.
+    """
+
+    def __init__(self, api, keep=2):
+        """ImagePool default builder."""
+
+        self.keep = keep
+        self.allocated = 0
+        self.in_use = 0
+        self._api = api
+        self._idle = {}
+        self._lock = threading.Lock()
+
+
+    @contextlib.contextmanager
+    def acquire(self, width, height, chans):
+        """Hand out an image of the given resolution for the context duration.
+
+        Args:
+            width: An int representing the image width.
+            height: An int representing the image height.
+            chans: An int representing the number of channels.
+
+        Yields:
+            An IMAGE instance whose content is undefined.
+        """
+
+        shape = (width, height, chans)
+        with self._lock:
+            idle = self._idle.get(shape)
+            img = idle.pop() if idle else None
+            self.in_use += 1
+
+        if img is None:
+            img = self._api.make_image(width, height, chans)
+            with self._lock:
+                self.allocated += 1
+
+        try:
+            yield img
+        finally:
+            with self._lock:
+                self.in_use -= 1
+                idle = self._idle.setdefault(shape, [])
+                if len(idle) < self.keep:
+                    idle.append(img)
+                    img = None
+            if img is not None:
+                self._api.free_image(img)
+                with self._lock:
+                    self.allocated -= 1
+
+
+    def close(self):
+        """Free every idle image.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for images in idle.values():
+            for img in images:
+                self._api.free_image(img)
+                with self._lock:
+                    self.allocated -= 1
+
+
 def init_lib(libpath):
     """Initialize the library.
 
@@ -125,12 +545,146 @@ class Pydarknet():
 
     Attributes:
         library = The darknet library.
+        api = A DarknetApi holding the functions used per frame.
+        images = An ImagePool holding the reusable input images.
     """
 
     def __init__(self, libpath):
         """Pydarknet default builder."""
 
         self.library = init_lib(libpath)
+        self.api = DarknetApi(load_image=self.init_load_image(),
+                              make_image=self.init_make_image(),
+                              free_image=self.init_free_image(),
+                              predict_image=self.init_predict_image(),
+                              network_predict=self.init_network_predict(),
+                              set_batch_network=self.init_set_batch_network(),
+                              get_network_boxes=self.init_get_network_boxes(),
+                              do_nms_obj=self.init_do_nms_obj(),
+                              free_detections=self.init_free_detections(),
+                              network_width=self.library.network_width,
+                              network_height=self.library.network_height)
+        self.images = ImagePool(self.api)
+        self._live = collections.Counter()
+        self._class_tables = {}
+
+
+    def class_index(self, meta):
+        """Return the name to class index table of a model.
+
+        METADATA.names is decoded once per model, on first use; load the
+        table right after the metadata to keep it off the per-frame path.
+
+        Args:
+            meta: A meta object representing the model metadata.
+
+        Returns:
+            A dict mapping class names (str) to class indices.
+        """
+
+        key = ctypes.cast(meta.names, ctypes.c_void_p).value
+        table = self._class_tables.get(key)
+        if table is None:
+            table = {meta.names[i].decode('utf-8'): i
+                     for i in range(meta.classes)}
+            self._class_tables[key] = table
+
+        return table
+
+
+    def class_ids(self, meta, classes):
+        """Resolve class names or indices into class indices.
+
+        Args:
+            meta: A meta object representing the model metadata.
+            classes: An iterable of class names (str) or indices (int).
+
+        Returns:
+            A list of class indices.
+
+        Raises:
+            KeyError: A class name is not part of the model.
+        """
+
+        table = self.class_index(meta)
+
+        return [cls if isinstance(cls, int) else table[cls] for cls in classes]
+
+
+    def close(self):
+        """Release the pooled images.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        self.images.close()
+
+
+    def native_allocations(self):
+        """Report the native Darknet allocations currently alive.
+
+        Args:
+            None
+
+        Returns:
+            A dict with the pooled images allocated and in use, and the
+            loaded images and detection arrays not yet freed.
+        """
+
+        return {'pooled_images': self.images.allocated,
+                'pooled_in_use': self.images.in_use,
+                'loaded_images': self._live['images'],
+                'detections': self._live['detections']}
+
+
+    @contextlib.contextmanager
+    def loaded_image(self, path):
+        """Load an image file for the context duration.
+
+        Args:
+            path: A bytes string representing the image path.
+
+        Yields:
+            An IMAGE instance, freed when the context exits.
+        """
+
+        img = self.api.load_image(path, 0, 0)
+        self._live['images'] += 1
+        try:
+            yield img
+        finally:
+            self.api.free_image(img)
+            self._live['images'] -= 1
+
+
+    @contextlib.contextmanager
+    def network_boxes(self, net, img, thresh, hier_thresh):
+        """Get the network detections for the context duration.
+
+        Args:
+            net: A net object representing the network, already run on img.
+            img: An IMAGE instance representing the processed image.
+            thresh: An float representing the detection threshold.
+            hier_thresh: A float representing the detection threshold.
+
+        Yields:
+            A tuple (dets, num), dets being freed when the context exits.
+        """
+
+        pnum = ctypes.pointer(ctypes.c_int(0))
+        dets = self.api.get_network_boxes(net, img.w, img.h, thresh,
+                                          hier_thresh, None, 0, pnum)
+        num = pnum[0]
+        self._live['detections'] += 1
+        try:
+            yield dets, num
+        finally:
+            self.api.free_detections(dets, num)
+            self._live['detections'] -= 1
 
 
     def init_predict(self):
@@ -210,10 +764,20 @@ class Pydarknet():
         network_predict = self.library.network_predict
         network_predict.argtypes = [ctypes.c_void_p,
                                     ctypes.POINTER(ctypes.c_float)]
+        network_predict.restype = ctypes.POINTER(ctypes.c_float)
 
         return network_predict
 
 
+    def init_set_batch_network(self):
+        """Init and return a set_batch_network object."""
+
+        set_batch_network = self.library.set_batch_network
+        set_batch_network.argtypes = [ctypes.c_void_p, ctypes.c_int]
+
+        return set_batch_network
+
+
     def init_reset_rnn(self):
         """Init and return a reset_rnn object."""
 
@@ -233,6 +797,27 @@ class Pydarknet():
         return load_net
 
 
+    def load_network(self, cfg, weights, clear=0):
+        """Load a network and set it up for single image inference.
+
+        The batch is set to 1 once here, so network_predict can then be fed
+        network-sized inputs directly.
+
+        Args:
+            cfg: A bytes string representing the cfg file path.
+            weights: A bytes string representing the weights file path.
+            clear: An int; when set, the seen images counter is reset.
+
+        Returns:
+            A net object representing the loaded network.
+        """
+
+        net = self.init_load_net()(cfg, weights, clear)
+        self.api.set_batch_network(net, 1)
+
+        return net
+
+
     def init_do_nms_obj(self):
         """Init and return a do_nms_obj object."""
 
@@ -323,8 +908,7 @@ class Pydarknet():
             A list of detected objects as a result.
         """
 
-        predict_image = self.init_predict_image()
-        out = predict_image(net, img)
+        out = self.api.predict_image(net, img)
         res = []
         for i in range(meta.classes):
             res.append((meta.names[i], out[i]))
@@ -332,7 +916,64 @@ class Pydarknet():
         return res
 
 
-    def detect(self, model, thresh=.5, hier_thresh=.5, nms=.45): #pylint: disable=too-many-locals
+    def network_size(self, net):
+        """Return the network input size.
+
+        Args:
+            net: A net object representing the network.
+
+        Returns:
+            A (width, height) tuple.
+        """
+
+        return self.api.network_width(net), self.api.network_height(net)
+
+
+    def detect_image(self, net, meta, img, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments
+                     top_k=None, raw=False, classes=None):
+        """Detect objects in an already loaded Darknet image.
+
+        Args:
+            net: A net object representing the network to use.
+            meta: A meta object representing the model metadata.
+            img: An IMAGE instance representing the image to process.
+            thresh: An float representing the detection threshold.
+            hier_thresh: A float representing the detection threshold.
+            nms: A float representing a model parameter value.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return the RESULT_DTYPE structured array
+            instead of (name, prob, (x, y, w, h)) tuples.
+            classes: Optional iterable of class names or indices; only these
+            classes are inspected, and results carry int class ids instead
+            of names.
+
+        Returns:
+            A list of detected objects bounding boxes as a result, sorted by
+            decreasing probability.
+        """
+
+        class_ids = None if classes is None else self.class_ids(meta, classes)
+
+        self.api.predict_image(net, img)
+        res = self._boxes(net, meta, img, thresh, hier_thresh, nms, top_k,
+                          class_ids)
+
+        return format_results(meta, res, raw, class_ids is not None)
+
+
+    def _boxes(self, net, meta, img, thresh, hier_thresh, nms, top_k, #pylint: disable=too-many-arguments
+               class_ids):
+        """Extract the detections of a network already run on img."""
+
+        with self.network_boxes(net, img, thresh, hier_thresh) as (dets, num):
+            if nms:
+                self.api.do_nms_obj(dets, num, meta.classes, nms)
+            return extract_detections(dets, num, meta.classes, top_k,
+                                      class_ids)
+
+
+    def detect(self, model, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments
+               top_k=None, raw=False, classes=None):
         """Detect objects in an image.
 
         Args:
@@ -342,6 +983,10 @@ class Pydarknet():
             thresh: An float representing the detection threshold.
             hier_thresh: A float representing the detection threshold.
             nms: A float representing a model parameter value.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return a RESULT_DTYPE structured array.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
 
         Returns:
             A list of detected objects bounding boxes as a result.
@@ -349,36 +994,164 @@ class Pydarknet():
 
         net, meta, image = model
 
-        img = self.init_load_image()(image, 0, 0)
+        with self.loaded_image(image) as img:
+            return self.detect_image(net, meta, img, thresh, hier_thresh, nms,
+                                     top_k, raw, classes)
 
-        num = ctypes.c_int(0)
-        pnum = ctypes.pointer(num)
 
-        self.init_predict()
-        self.init_set_gpu()
-        self.init_make_image()
+    def prepare_frame(self, net, frame):
+        """Letterbox a frame to the network size, ahead of inference.
 
-        self.init_predict_image()(net, img)
+        Holds no Darknet resource, so it may run in another thread than
+        detect_prepared and overlap the inference of a previous frame.
 
-        dets = self.init_get_network_boxes()(net, img.w, img.h, thresh,
-                                             hier_thresh, None, 0, pnum)
+        Args:
+            net: A net object representing the network to prepare for.
+            frame: A HWC (or HW grayscale) uint8 NumPy array in BGR order.
 
-        num = pnum[0]
-        if nms:
-            self.init_do_nms_obj()(dets, num, meta.classes, nms)
+        Returns:
+            A tuple (planes, geometry) as returned by letterbox_frame.
+        """
 
-        res = []
-        for j in range(num):
-            for i in range(meta.classes):
-                if dets[j].prob[i] > 0:
-                    bound = dets[j].bbox
-                    res.append((meta.names[i], dets[j].prob[i],
-                                (bound.x, bound.y, bound.w, bound.h)))
+        return letterbox_frame(frame, *self.network_size(net))
 
-        res = sorted(res, key=lambda x: -x[1])
 
-        self.init_free_image()(img)
+    def detect_prepared(self, net, meta, prepared, thresh=.5, hier_thresh=.5, #pylint: disable=too-many-arguments
+                        nms=.45, top_k=None, raw=False, classes=None):
+        """Detect objects in a frame prepared by prepare_frame.
 
-        self.init_free_detections()(dets, num)
+        The planes are copied into a pooled network-sized image and fed to
+        network_predict, which runs the network on them as is: unlike
+        network_predict_image, it neither letterboxes nor allocates an image.
+        Boxes are mapped back to source frame pixels through the cached
+        letterbox geometry. The network must have been loaded with
+        load_network, which sets its batch to 1.
 
-        return res
+        Args:
+            net: A net object representing the network to use.
+            meta: A meta object representing the model metadata.
+            prepared: A tuple (planes, geometry) from prepare_frame.
+            thresh: An float representing the detection threshold.
+            hier_thresh: A float representing the detection threshold.
+            nms: A float representing a model parameter value.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return a RESULT_DTYPE structured array.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A list of detected objects bounding boxes as a result.
+        """
+
+        planes, geometry = prepared
+        chans, height, width = planes.shape
+        class_ids = None if classes is None else self.class_ids(meta, classes)
+
+        with self.images.acquire(width, height, chans) as img:
+            np.copyto(np.ctypeslib.as_array(img.data, shape=planes.shape),
+                      planes)
+            self.api.network_predict(net, img.data)
+            res = self._boxes(net, meta, img, thresh, hier_thresh, nms, top_k,
+                              class_ids)
+
+        return format_results(meta, unletterbox(res, geometry), raw,
+                              class_ids is not None)
+
+
+    def detect_array(self, model, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments
+                     top_k=None, raw=False, classes=None):
+        """Detect objects in an in-memory frame.
+
+        The frame is letterboxed once to the network size into a pooled
+        image, so no image is allocated per frame.
+
+        Args:
+            model: A tuple (net, meta, frame), frame being a HWC uint8 NumPy
+            array in BGR order.
+            thresh: An float representing the detection threshold.
+            hier_thresh: A float representing the detection threshold.
+            nms: A float representing a model parameter value.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return a RESULT_DTYPE structured array.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A list of detected objects bounding boxes as a result, in source
+            frame pixels.
+        """
+
+        net, meta, frame = model
+
+        return self.detect_prepared(net, meta, self.prepare_frame(net, frame),
+                                    thresh, hier_thresh, nms, top_k, raw,
+                                    classes)
+
+
+    def detect_bytes(self, model, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments
+                     top_k=None, raw=False, classes=None):
+        """Detect objects in an in-memory encoded image.
+
+        Args:
+            model: A tuple (net, meta, buf), buf being a bytes-like object
+            holding an encoded (e.g. JPEG) image.
+            thresh: An float representing the detection threshold.
+            hier_thresh: A float representing the detection threshold.
+            nms: A float representing a model parameter value.
+            top_k: Optional int bounding the number of results kept.
+            raw: A bool; when True, return a RESULT_DTYPE structured array.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A list of detected objects bounding boxes as a result.
+        """
+
+        net, meta, buf = model
+
+        return self.detect_array((net, meta, decode_image(buf)), thresh,
+                                 hier_thresh, nms, top_k, raw, classes)
+
+
+    def detect_batch(self, model, thresh=.5, hier_thresh=.5, nms=.45, #pylint: disable=too-many-arguments
+                     top_k=None, raw=False, classes=None):
+        """Detect objects in several in-memory images.
+
+        Frames are letterboxed and processed one at a time over the bound
+        functions, as detect_array does. Darknet's network_predict_batch is
+        not used: only the AlexeyAB fork exports it, with a detection struct
+        laid out differently from DETECTION.
+
+        Args:
+            model: A tuple (net, meta, frames), frames being a list of HWC
+            uint8 BGR arrays or of encoded images given as bytes.
+            thresh: An float representing the detection threshold.
+            hier_thresh: A float representing the detection threshold.
+            nms: A float representing a model parameter value.
+            top_k: Optional int bounding the number of results per image.
+            raw: A bool; when True, results are RESULT_DTYPE arrays.
+            classes: Optional iterable of class names or indices to restrict
+            the detection to; results then carry int class ids.
+
+        Returns:
+            A tuple (results, stats): results holds one detection list per
+            frame, in order, and stats is a dict with the image count, the
+            number of forward passes and the total and per-image seconds.
+        """
+
+        net, meta, frames = model
+        start = time.perf_counter()
+
+        frames = [frame if isinstance(frame, np.ndarray) else decode_image(frame)
+                  for frame in frames]
+        results = [self.detect_array((net, meta, frame), thresh, hier_thresh,
+                                     nms, top_k, raw, classes)
+                   for frame in frames]
+
+        elapsed = time.perf_counter() - start
+        stats = {'images': len(frames),
+                 'passes': len(frames),
+                 'total': elapsed,
+                 'per_image': elapsed / len(frames) if frames else 0.0}
+
+        return results, stats
@@ -18,9 +18,28 @@ export CARO_CLOUD_INSTANCE_IP=192.168.100.163
 export CARO_CLOUD_SSH_USERNAME=centos
 export CARO_CLOUD_SSH_KEYFILE=darknet-proto.pem
 
+export CARO_PIPELINE_DEPTH=1
+export CARO_TRANSPORT=tcp
+export CARO_DATAGRAM_RATE=1250000
+export CARO_CHANGE_THRESHOLD=4
+export CARO_JPEG_QUALITY=90
+export CARO_JPEG_SUBSAMPLING=420
+export CARO_ARCHIVE_FRAMES=False
+export CARO_SERVER_MODE=async
+export CARO_INFERENCE_QUEUE=4
+# Experimental: detect in a crop around the last target. The crop is
+# upscaled to the network input, so it only pays off with a network input
+# smaller than the source frames and targets small in the frame; leave it
+# off otherwise.
+export CARO_ROI_TRACKING=False
+export CARO_ROI_EXPAND=3
+export CARO_ROI_REFRESH=10
+
 export CARO_DARKNET_FOLDER=$CARO_FOLDER/darknet
 export CARO_DARKNET_LABEL=banana
 
 export CARO_DARKNET_CFG=$CARO_DARKNET_FOLDER/yolov3-banana.cfg
 export CARO_DARKNET_WEIGHTS=$CARO_DARKNET_FOLDER/yolov3-banana_16000.weights
 export CARO_DARKNET_DATA=$CARO_DARKNET_FOLDER/banana.data
+export CARO_DARKNET_WORKERS=1
+export CARO_DARKNET_BACKEND=darknet
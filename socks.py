@@ -2,30 +2,116 @@
 Module supporting various functions responsible for initiating and managing
 socket connections between a client and a server.
 
+Client and server exchange binary messages. Each message starts with a fixed
+header (protocol version, message type, frame id, payload length) followed by
+the payload itself, so a frame and its result take a single round trip.
+
 function init_client_socket: Initialize client socket.
 
 function init_server_socket: Initialize server socket.
 
-function receive_bytes_to_string: Convert incoming messages from bytes to str.
+function recv_exact: Receive exactly a given number of bytes.
+
+function recv_exact_into: Fill a writable buffer from the socket.
+
+function receive_header: Receive and check one message header.
+
+function send_message: Send one header-framed message to the peer.
+
+function receive_message: Receive one header-framed message from the peer.
+
+function send_frame: Send frame file to the peer.
+
+function send_frame_bytes: Send in-memory encoded frame to the peer.
+
+function receive_frame: Receive one frame into a reusable buffer.
+
+function save_frame: Archive a received frame to disk.
+
+function send_result: Send a translation vector result to the peer.
+
+function send_error: Send an error message to the peer.
+
+function receive_result: Receive the translation vector for a frame.
+
+function send_bye: Announce the end of a session to the peer.
+
+function send_hello: Announce the datagram session token of a client.
+
+function send_info: Greet a new client with the network input size.
+
+function receive_info: Receive the server greeting.
+
+function init_datagram_socket: Initialize a datagram (UDP) socket.
+
+function send_frame_datagrams: Send a frame as numbered datagram chunks.
+
+function async_receive_message: Receive one message from an asyncio event loop.
+
+function async_receive_frame: Receive one frame from an asyncio event loop.
+
+function async_send_message: Send one message from an asyncio event loop.
+
+function async_send_result: Send a result from an asyncio event loop.
+
+function async_send_error: Send an error from an asyncio event loop.
+
+function async_send_info: Greet a new client from an asyncio event loop.
+
+class FrameBuffer: Reusable preallocated buffer for incoming frames.
+
+class ClientSession: Persistent client connection streaming many frames.
 
-function send_frame_size: Send frame size to client.
+class PipelinedSession: Client session keeping several frames in flight.
 
-function send_frame: Send frame to client.
+class DatagramReassembler: Rebuilds datagram frames, newest frame wins.
 
-function receive_frame: Receive and save one frame.
+class DatagramSession: Client session sending frames over datagrams.
 
-function waiting_for_ack: Wait for a particular frame/message to be acked by
-server.
+class AsyncDatagramFrames: Server-side datagram endpoint, newest frame wins.
 
-function send_msg: Send arbitrary message to the peer.
+class ProtocolError: Raised on malformed or unexpected messages.
 """
 
-import socket
 import os
+import socket
+import asyncio
+import secrets
+import struct
+import threading
+import time
 
 import netifaces as ni #pylint: disable=import-error
 
 
+PROTOCOL_VERSION = 3
+
+MSG_FRAME = 1
+MSG_RESULT = 2
+MSG_ERROR = 3
+MSG_BYE = 4
+MSG_HELLO = 5
+MSG_INFO = 6
+
+HEADER = struct.Struct('!BBII')
+# Largest payload accepted from a peer; the header length is untrusted.
+MAX_FRAME_SIZE = 1 << 23
+VECTOR = struct.Struct('!ii')
+HELLO = struct.Struct('!I')
+INFO = struct.Struct('!HH')
+
+# Datagram chunk header: version, session token, frame id, chunk index,
+# chunk count. The token, announced in HELLO, identifies the session since
+# NATs may rewrite the sender port. The payload size keeps chunks under a
+# typical 1500 bytes MTU.
+CHUNK = struct.Struct('!BIIHH')
+CHUNK_PAYLOAD = 1400
+DATAGRAM_PORT = 5001
+# Requested datagram socket buffer size, capped by net.core.[rw]mem_max; a
+# large frame arrives as hundreds of chunks at once.
+DATAGRAM_BUFFER = 1 << 22
+
+
 def init_client_socket(address, port=5000):
     """Initialize client socket.
 
@@ -64,120 +150,1176 @@ def init_server_socket(address=None, port=5000):
     return server_socket
 
 
-def receive_bytes_to_string(client_sock):
-    """Convert incoming messages from bytes to str.
+class ProtocolError(Exception):
+    """Raised when the peer sends a malformed or unexpected message."""
 
-    Receives message first, then do the byte to str translation.
+
+def recv_exact_into(sock, view):
+    """Fill a writable buffer from sock.
 
     Args:
-        client_sock: A socket instance representing the client socket.
+        sock: A socket instance representing the peer connection.
+        view: A writable memoryview to fill completely.
 
     Returns:
         None
+
+    Raises:
+        ConnectionError: The peer closed the connection mid-message.
     """
 
-    byte_msg = client_sock.recv(1024)
-    str_msg = byte_msg.decode('utf-8').replace("\n", "")
+    size = len(view)
+    received = 0
+    while received < size:
+        nbytes = sock.recv_into(view[received:])
+        if nbytes == 0:
+            raise ConnectionError("connection closed by peer")
+        received += nbytes
+
+
+def recv_exact(sock, size):
+    """Receive exactly size bytes from sock.
+
+    Args:
+        sock: A socket instance representing the peer connection.
+        size: An int representing the number of bytes to read.
+
+    Returns:
+        A bytes object of length size.
+
+    Raises:
+        ConnectionError: The peer closed the connection mid-message.
+    """
 
-    return str_msg
+    buf = bytearray(size)
+    recv_exact_into(sock, memoryview(buf))
 
+    return bytes(buf)
 
-def send_frame_size(client_socket, frame_loc):
-    """Send frame size to client.
 
-    Function useful for the server since it will use this result to compute
-    frame size and bytes reception accordingly. With this number, a
-    server can exactly knows how many bytes to expect from a stream flow in
-    order to fully receive a frame.
+def send_message(sock, msg_type, frame_id, payload=b''):
+    """Send one header-framed message to the peer.
 
     Args:
-        client_socket: A socket instance, used for client/server interactions.
-        frame_loc: A string representing the frame location to compute and
-        send size from.
+        sock: A socket instance representing the peer connection.
+        msg_type: An int representing the message type (MSG_*).
+        frame_id: An int identifying the frame the message refers to.
+        payload: Optional bytes-like object carried by the message.
 
     Returns:
         None
     """
 
-    filesize = os.path.getsize(frame_loc)
-    client_socket.send(str(filesize).encode('ascii'))
+    payload = memoryview(payload).cast('B')
+    header = HEADER.pack(PROTOCOL_VERSION, msg_type, frame_id, len(payload))
+
+    # Gather header and payload in as few syscalls as possible, without
+    # copying the payload into a concatenated buffer.
+    views = [memoryview(header), payload] if payload else [memoryview(header)]
+    while views:
+        sent = sock.sendmsg(views)
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def receive_header(sock):
+    """Receive and check one message header.
+
+    Args:
+        sock: A socket instance representing the peer connection.
+
+    Returns:
+        A tuple (msg_type, frame_id, payload_length).
+
+    Raises:
+        ProtocolError: The peer speaks another protocol version, or
+        announced a payload larger than MAX_FRAME_SIZE.
+    """
+
+    return _unpack_header(recv_exact(sock, HEADER.size))
+
+
+def _unpack_header(data):
+    """Unpack a header and check its protocol version and payload length."""
+
+    version, msg_type, frame_id, length = HEADER.unpack(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError("unsupported protocol version %d" % version)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError("payload of %d bytes exceeds %d bytes"
+                            % (length, MAX_FRAME_SIZE))
+
+    return msg_type, frame_id, length
+
+
+def receive_message(sock):
+    """Receive one header-framed message from the peer.
+
+    Args:
+        sock: A socket instance representing the peer connection.
+
+    Returns:
+        A tuple (msg_type, frame_id, payload).
+
+    Raises:
+        ProtocolError: The peer speaks another protocol version, or
+        announced a payload larger than MAX_FRAME_SIZE.
+    """
+
+    msg_type, frame_id, length = receive_header(sock)
+    payload = recv_exact(sock, length) if length else b''
+
+    return msg_type, frame_id, payload
 
 
-def send_frame(client_socket, frame_loc):
-    """Send frame to client.
+def send_frame(client_socket, frame_loc, frame_id=0):
+    """Send frame file to the peer.
+
+    The file content is handed to the kernel with sendfile, so the frame is
+    never copied through user space.
 
     Args:
         client_socket: A socket instance, used for client/server interactions.
         frame_loc: A string representing the frame location.
+        frame_id: Optional int identifying the frame.
 
     Returns:
         None
     """
 
     with open(frame_loc, 'rb') as filedesc:
-        buf = filedesc.readline(1024)
-        while buf:
-            client_socket.send(buf)
-            buf = filedesc.readline(1024)
-        filedesc.close()
+        size = os.fstat(filedesc.fileno()).st_size
+        client_socket.sendall(HEADER.pack(PROTOCOL_VERSION, MSG_FRAME,
+                                          frame_id, size))
+        client_socket.sendfile(filedesc, 0, size)
+
+
+def send_frame_bytes(client_socket, frame, frame_id=0):
+    """Send in-memory encoded frame to the peer.
+
+    Args:
+        client_socket: A socket instance, used for client/server interactions.
+        frame: A bytes-like object holding the encoded frame.
+        frame_id: Optional int identifying the frame.
+
+    Returns:
+        None
+    """
+
+    send_message(client_socket, MSG_FRAME, frame_id, frame)
+
+
+def _send_any_frame(client_socket, frame, frame_id):
+    """Send a frame given either as a file path or as encoded bytes."""
 
+    if isinstance(frame, str):
+        send_frame(client_socket, frame, frame_id)
+    else:
+        send_frame_bytes(client_socket, frame, frame_id)
 
-def receive_frame(client_sock, frame_size, save_loc):
-    """Receive and save one frame.
 
-    Main function responsible for storing and saving exactly one frame from
-    a remote client. In order to properly delimitate a frame from a stream,
-    the function also takes the frame size as a parameter and compute the
-    necessary incoming byte number to expect.
+def receive_frame(client_sock, frame_buf):
+    """Receive one frame into a reusable buffer.
+
+    The frame is read straight into frame_buf, without intermediate copies
+    nor disk writes. The returned view is only valid until the next frame
+    is received into the same buffer.
 
     Args:
         client_sock: A socket instance representing a client connection.
-        frame_size: An int representing the frame size to expect.
-        save_loc: A string representing the destination where to save the
-        frame
+        frame_buf: A FrameBuffer instance receiving the frame bytes.
 
     Returns:
-        None
+        A tuple (frame_id, view), view being a memoryview over the frame
+        bytes. Both are None when the peer ended the session.
+
+    Raises:
+        ProtocolError: The peer sent something other than a frame.
+    """
+
+    msg_type, frame_id, length = receive_header(client_sock)
+    if msg_type == MSG_BYE:
+        return None, None
+    if msg_type != MSG_FRAME:
+        recv_exact(client_sock, length)
+        raise ProtocolError("expected frame, got message type %d" % msg_type)
+
+    view = frame_buf.view(length)
+    recv_exact_into(client_sock, view)
+
+    return frame_id, view
+
+
+def save_frame(view, save_loc, frame_id):
+    """Archive a received frame to disk.
+
+    Args:
+        view: A bytes-like object holding the encoded frame.
+        save_loc: A string representing the destination folder.
+        frame_id: An int identifying the frame.
+
+    Returns:
+        A string representing the path of the saved frame.
     """
 
-    img_size = 0
-    filename = save_loc + "frame.jpg"
+    filename = os.path.join(save_loc, "frame_%06d.jpg" % frame_id)
     with open(filename, 'wb') as img:
-        while img_size < frame_size:
-            remain = frame_size - img_size
-            if remain < 1024:
-                data = client_sock.recv(remain)
-            else:
-                data = client_sock.recv(1024)
-            img.write(data)
-            img_size += len(data)
+        img.write(view)
+
+    return filename
 
 
-def waiting_for_ack(client_socket, exptype='FRAME'):
-    """Wait for a particular frame/message to be acked by server.
+def send_result(client_sock, frame_id, vector):
+    """Send a translation vector result to the peer.
+
+    Args:
+        client_sock: A socket instance representing the client connection.
+        frame_id: An int identifying the frame the result refers to.
+        vector: A (x, y) tuple, or an empty value when nothing was detected.
+
+    Returns:
+        None
+    """
+
+    send_message(client_sock, MSG_RESULT, frame_id, _pack_vector(vector))
+
+
+def _pack_vector(vector):
+    """Encode a translation vector as a result payload."""
+
+    return VECTOR.pack(*vector) if vector else b''
+
+
+def send_error(client_sock, frame_id, msg):
+    """Send an error message to the peer.
+
+    Args:
+        client_sock: A socket instance representing the client connection.
+        frame_id: An int identifying the frame the error refers to.
+        msg: A string describing the error.
+
+    Returns:
+        None
+    """
+
+    send_message(client_sock, MSG_ERROR, frame_id, str(msg).encode('utf-8'))
+
+
+def receive_result(client_socket):
+    """Receive the translation vector for a frame.
 
     Args:
         client_socket: A socket instance, used for client/server interactions.
-        exptype: A string representing the type of ack to wait for.
+
+    Returns:
+        A tuple (frame_id, vector), vector being a (x, y) tuple or None when
+        nothing was detected.
+
+    Raises:
+        ProtocolError: The peer reported an error or sent an unexpected
+        message.
+    """
+
+    msg_type, frame_id, payload = receive_message(client_socket)
+    if msg_type == MSG_ERROR:
+        raise ProtocolError("frame %d: %s" % (frame_id, payload.decode('utf-8')))
+    if msg_type != MSG_RESULT:
+        raise ProtocolError("expected result, got message type %d" % msg_type)
+
+    vector = VECTOR.unpack(payload) if payload else None
+
+    return frame_id, vector
+
+
+def send_bye(client_sock):
+    """Announce the end of a session to the peer.
+
+    Args:
+        client_sock: A socket instance representing the peer connection.
 
     Returns:
         None
     """
 
-    msg = client_socket.recv(1024).decode('UTF-8')
-    while msg != 'OK ' + exptype:
-        msg = client_socket.recv(1024).decode('UTF-8')
+    send_message(client_sock, MSG_BYE, 0)
+
 
+def send_hello(client_sock, token):
+    """Announce the datagram session token of a client to the server.
 
-def send_msg(client_sock, msg):
-    """Send message to the peer.
+    The server then sends results for datagram frames carrying that token
+    over this connection.
+
+    Args:
+        client_sock: A socket instance representing the server connection.
+        token: An int representing the 32-bit session token.
+
+    Returns:
+        None
+    """
+
+    send_message(client_sock, MSG_HELLO, 0, HELLO.pack(token))
+
+
+def send_info(client_sock, input_size):
+    """Greet a new client with the network input size.
+
+    The server sends this message first on every connection, so the client
+    can shrink its frames to what the network actually processes.
 
     Args:
         client_sock: A socket instance representing the client connection.
-        msg: An string representing the message to send.
+        input_size: A (width, height) tuple, or None when unknown.
+
+    Returns:
+        None
+    """
+
+    send_message(client_sock, MSG_INFO, 0, INFO.pack(*(input_size or (0, 0))))
+
+
+def receive_info(client_socket):
+    """Receive the server greeting.
+
+    Args:
+        client_socket: A socket instance representing the server connection.
+
+    Returns:
+        A (width, height) tuple representing the network input size, or None
+        when the server did not advertise one.
+
+    Raises:
+        ProtocolError: The server sent something other than a greeting.
+    """
+
+    msg_type, _, payload = receive_message(client_socket)
+    if msg_type != MSG_INFO:
+        raise ProtocolError("expected greeting, got message type %d" % msg_type)
+
+    width, height = INFO.unpack(payload)
+
+    return (width, height) if width and height else None
+
+
+def init_datagram_socket(address='', port=0):
+    """Initialize a datagram (UDP) socket.
+
+    Args:
+        address: Optional string representing the IP address to bind to.
+        port: Optional int representing the port to bind to, 0 for any.
+
+    Returns:
+        A bound datagram socket, with DATAGRAM_BUFFER sized buffers.
+    """
+
+    datagram_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagram_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    datagram_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                               DATAGRAM_BUFFER)
+    datagram_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                               DATAGRAM_BUFFER)
+    datagram_socket.bind((address, port))
+
+    return datagram_socket
+
+
+def send_frame_datagrams(datagram_socket, address, frame, frame_id, token, #pylint: disable=too-many-arguments
+                         rate=None):
+    """Send a frame as numbered datagram chunks.
+
+    With a rate, chunks are paced instead of sent in one burst, which
+    queues along the path and the receiver buffer would drop.
+
+    Args:
+        datagram_socket: A datagram socket instance.
+        address: A (host, port) tuple representing the receiver.
+        frame: A bytes-like object holding the encoded frame.
+        frame_id: An int identifying the frame.
+        token: An int representing the session token announced in HELLO.
+        rate: Optional int representing the pace in bytes per second.
+
+    Returns:
+        An int representing the number of chunks sent.
+    """
+
+    view = memoryview(frame).cast('B')
+    count = max(1, -(-len(view) // CHUNK_PAYLOAD))
+    start = time.perf_counter()
+
+    for index in range(count):
+        if rate:
+            ahead = start + index * CHUNK_PAYLOAD / rate - time.perf_counter()
+            if ahead > 0:
+                time.sleep(ahead)
+        chunk = view[index * CHUNK_PAYLOAD:(index + 1) * CHUNK_PAYLOAD]
+        header = CHUNK.pack(PROTOCOL_VERSION, token, frame_id, index, count)
+        datagram_socket.sendmsg([header, chunk], [], 0, address)
+
+    return count
+
+
+class FrameBuffer():
+    """Reusable preallocated buffer for incoming frames.
+
+    The buffer only grows when a frame larger than any previous one comes
+    in, so steady-state reception does not allocate.
+
+    Attributes:
+        capacity: An int representing the current buffer size in bytes.
+    """
+
+    def __init__(self, capacity=1 << 20):
+        """FrameBuffer default builder."""
+
+        self._buf = bytearray(capacity)
+
+
+    @property
+    def capacity(self):
+        """Getter for FrameBuffer capacity.
+
+        Args:
+            None
+
+        Returns:
+            An int representing the current buffer size in bytes.
+        """
+
+        return len(self._buf)
+
+
+    def view(self, size):
+        """Return a writable view of size bytes, growing the buffer if needed.
+
+        Args:
+            size: An int representing the number of bytes needed.
+
+        Returns:
+            A memoryview over the first size bytes of the buffer.
+
+        Raises:
+            ProtocolError: size exceeds MAX_FRAME_SIZE.
+        """
+
+        if size > MAX_FRAME_SIZE:
+            raise ProtocolError("payload of %d bytes exceeds %d bytes"
+                                % (size, MAX_FRAME_SIZE))
+
+        if size > len(self._buf):
+            self._buf = bytearray(max(size, min(2 * len(self._buf),
+                                                MAX_FRAME_SIZE)))
+
+        return memoryview(self._buf)[:size]
+
+
+class ClientSession():
+    """Persistent client connection streaming many frames to the server.
+
+    The connection is opened once and reused for every frame. When the link
+    fails, the session reconnects and resends the pending frame.
+
+    Attributes:
+        address: A string representing the server IP address.
+        port: An int representing the server port.
+        retry: An int representing the reconnect attempts per frame.
+        delay: A float representing the seconds to wait between attempts.
+        input_size: A (width, height) tuple advertised by the server, or
+        None before connecting or when the server did not advertise one.
+    """
+
+    def __init__(self, address, port=5000, retry=3, delay=1.0):
+        """ClientSession default builder."""
+
+        self.address = address
+        self.port = port
+        self.retry = retry
+        self.delay = delay
+        self.input_size = None
+        self._sock = None
+
+
+    def __enter__(self):
+        """Open the session connection."""
+
+        self.connect()
+        return self
+
+
+    def __exit__(self, *_):
+        """Close the session connection."""
+
+        self.close()
+
+
+    def connect(self):
+        """Open the connection to the server if not already open.
+
+        Args:
+            None
+
+        Returns:
+            The connected socket instance.
+        """
+
+        if self._sock is None:
+            sock = init_client_socket(self.address, self.port)
+            try:
+                self.input_size = receive_info(sock)
+            except (OSError, ProtocolError):
+                sock.close()
+                raise
+            self._sock = sock
+
+        return self._sock
+
+
+    def close(self):
+        """Cleanly end the session and close the connection.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        if self._sock is None:
+            return
+
+        try:
+            send_bye(self._sock)
+        except OSError:
+            pass
+        finally:
+            self._sock.close()
+            self._sock = None
+
+
+    def _drop(self):
+        """Discard a broken connection without the goodbye message."""
+
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+    def exchange(self, frame, frame_id):
+        """Send one frame and wait for its result, reconnecting on failure.
+
+        Args:
+            frame: A string representing the frame location, or a bytes-like
+            object holding the encoded frame.
+            frame_id: An int identifying the frame.
+
+        Returns:
+            A tuple (frame_id, vector) as returned by receive_result.
+
+        Raises:
+            OSError: The server stayed unreachable after all retries.
+        """
+
+        for attempt in range(self.retry + 1):
+            try:
+                sock = self.connect()
+                _send_any_frame(sock, frame, frame_id)
+                return receive_result(sock)
+            except OSError:
+                self._drop()
+                if attempt == self.retry:
+                    raise
+                time.sleep(self.delay)
+
+        return frame_id, None
+
+
+class PipelinedSession(ClientSession):
+    """Client session keeping up to depth frames in flight.
+
+    Frames are sent without waiting for their result. Each connection gets
+    its own reader thread and in-flight set; the reader collects results as
+    they arrive, and only the newest one is handed out by latest(), older
+    ones are dropped as stale.
+
+    Attributes:
+        depth: An int representing the maximum number of frames in flight.
+        timeout: A float representing the seconds submit waits for an
+        in-flight slot before deeming the connection dead.
+        stale: An int counting results dropped because a newer one arrived.
+        errors: An int counting frames the server failed to process.
+    """
+
+    def __init__(self, address, port=5000, retry=3, delay=1.0, depth=2, #pylint: disable=too-many-arguments
+                 timeout=10.0):
+        """PipelinedSession default builder."""
+
+        super().__init__(address, port, retry, delay)
+        self.depth = depth
+        self.timeout = timeout
+        self.stale = 0
+        self.errors = 0
+        self._cond = threading.Condition()
+        self._in_flight = set()
+        self._newest = None
+        self._applied = -1
+        self._reader = None
+
+
+    def connect(self):
+        """Open the connection and start its result reader if needed.
+
+        A connection whose reader has exited is dropped and reopened.
+
+        Args:
+            None
+
+        Returns:
+            The connected socket instance.
+        """
+
+        if self._sock is not None and not self._reader.is_alive():
+            # The server ended the connection; nothing reads its results.
+            self._drop()
+
+        fresh = self._sock is None
+        sock = super().connect()
+        if fresh:
+            with self._cond:
+                self._in_flight = set()
+            self._reader = threading.Thread(target=self._read_results,
+                                            args=(sock, self._in_flight),
+                                            daemon=True)
+            self._reader.start()
+
+        return sock
+
+
+    def _drop(self):
+        """Discard a broken connection and stop its result reader."""
+
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        super()._drop()
+
+        if self._reader is not None:
+            self._reader.join(self.timeout)
+            self._reader = None
+
+
+    def _read_results(self, sock, in_flight):
+        """Reader thread body: collect results until the connection ends.
+
+        Only the in-flight set of its own connection is updated, so a late
+        exit never touches the frames of a newer connection.
+        """
+
+        while True:
+            try:
+                msg_type, frame_id, payload = receive_message(sock)
+            except (OSError, ProtocolError):
+                break
+
+            with self._cond:
+                in_flight.discard(frame_id)
+                if msg_type == MSG_RESULT:
+                    vector = VECTOR.unpack(payload) if payload else None
+                    newest = self._newest[0] if self._newest else self._applied
+                    if frame_id > newest:
+                        if self._newest is not None:
+                            self.stale += 1
+                        self._newest = (frame_id, vector)
+                    else:
+                        self.stale += 1
+                else:
+                    self.errors += 1
+                self._cond.notify_all()
+
+        with self._cond:
+            in_flight.clear()
+            self._cond.notify_all()
+
+
+    def submit(self, frame, frame_id):
+        """Send one frame without waiting for its result.
+
+        Blocks while depth frames are already in flight. When no result
+        frees a slot within timeout, the connection is reopened. Frame ids
+        must be increasing for stale results to be detected.
+
+        Args:
+            frame: A string representing the frame location, or a bytes-like
+            object holding the encoded frame.
+            frame_id: An int identifying the frame.
+
+        Returns:
+            None
+
+        Raises:
+            OSError: The server stayed unreachable after all retries.
+        """
+
+        with self._cond:
+            stalled = not self._cond.wait_for(
+                lambda: len(self._in_flight) < self.depth, self.timeout)
+        if stalled:
+            self._drop()
+
+        for attempt in range(self.retry + 1):
+            try:
+                sock = self.connect()
+                with self._cond:
+                    self._in_flight.add(frame_id)
+                _send_any_frame(sock, frame, frame_id)
+                return
+            except OSError:
+                with self._cond:
+                    self._in_flight.discard(frame_id)
+                self._drop()
+                if attempt == self.retry:
+                    raise
+                time.sleep(self.delay)
+
+
+    def latest(self):
+        """Return the newest result not handed out yet.
+
+        Args:
+            None
+
+        Returns:
+            A tuple (frame_id, vector), or None when no new result arrived.
+        """
+
+        with self._cond:
+            newest, self._newest = self._newest, None
+            if newest is not None:
+                self._applied = newest[0]
+
+        return newest
+
+
+    def close(self):
+        """Cleanly end the session once in-flight results are collected.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        if self._sock is None:
+            return
+
+        try:
+            send_bye(self._sock)
+            self._sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+        if self._reader is not None:
+            self._reader.join(self.delay * (self.retry + 1))
+            self._reader = None
+
+        self._drop()
+
+
+class DatagramReassembler():
+    """Rebuilds frames from datagram chunks, the newest frame winning.
+
+    Chunks of a frame older than the one being assembled are ignored, and a
+    chunk of a newer frame discards whatever was assembled so far. A frame is
+    only handed out once all its chunks arrived. Chunks announcing more than
+    MAX_FRAME_SIZE bytes, or a count other than the one of their frame's
+    first chunk, are dropped.
+
+    Attributes:
+        completed: An int counting the frames fully reassembled.
+        dropped: An int counting the frames discarded incomplete.
+    """
+
+    def __init__(self):
+        """DatagramReassembler default builder."""
+
+        self.completed = 0
+        self.dropped = 0
+        self._frame_id = -1
+        self._count = 0
+        self._chunks = {}
+        self._done = False
+
+
+    def feed(self, datagram):
+        """Add one datagram chunk.
+
+        Args:
+            datagram: A bytes object holding one chunk and its header.
+
+        Returns:
+            A tuple (frame_id, frame) when the chunk completes a frame,
+            None otherwise.
+        """
+
+        if len(datagram) < CHUNK.size:
+            return None
+
+        version, _, frame_id, index, count = CHUNK.unpack_from(datagram)
+        if (version != PROTOCOL_VERSION or index >= count
+                or count * CHUNK_PAYLOAD > MAX_FRAME_SIZE):
+            return None
+
+        if frame_id < self._frame_id or (frame_id == self._frame_id
+                                         and (self._done
+                                              or count != self._count)):
+            return None
+
+        if frame_id > self._frame_id:
+            if self._chunks:
+                self.dropped += 1
+            self._frame_id = frame_id
+            self._count = count
+            self._chunks = {}
+            self._done = False
+
+        self._chunks[index] = datagram[CHUNK.size:]
+        if len(self._chunks) < self._count:
+            return None
+
+        frame = b''.join(self._chunks[i] for i in range(self._count))
+        self._chunks = {}
+        self._done = True
+        self.completed += 1
+
+        return frame_id, frame
+
+
+class DatagramSession(PipelinedSession):
+    """Client session sending frames over datagrams.
+
+    Frames go out as numbered UDP chunks and are never retransmitted: a lost
+    chunk loses the frame, and the server only processes the newest complete
+    frame. Results come back over the reliable connection, and latest()
+    hands out the newest one like PipelinedSession does. Each connection
+    announces a fresh random token, which every chunk carries, so the
+    server does not depend on the sender address surviving NAT.
+
+    Attributes:
+        datagram_port: An int representing the server datagram port.
+        rate: Optional int representing the datagram pace in bytes per
+        second; None sends each frame in one burst.
+    """
+
+    def __init__(self, address, port=5000, retry=3, delay=1.0, #pylint: disable=too-many-arguments
+                 datagram_port=DATAGRAM_PORT, rate=None):
+        """DatagramSession default builder."""
+
+        super().__init__(address, port, retry, delay, depth=1)
+        self.datagram_port = datagram_port
+        self.rate = rate
+        self._token = None
+        self._datagram_sock = init_datagram_socket()
+
+
+    def connect(self):
+        """Open the result connection and announce a new session token.
+
+        Args:
+            None
+
+        Returns:
+            The connected socket instance.
+        """
+
+        previous = self._sock
+        sock = super().connect()
+        if sock is not previous:
+            self._token = secrets.randbits(32)
+            try:
+                send_hello(sock, self._token)
+            except OSError:
+                self._drop()
+                raise
+
+        return sock
+
+
+    def submit(self, frame, frame_id):
+        """Send one frame as datagrams, without waiting for anything.
+
+        The result connection is reopened first when it was lost.
+
+        Args:
+            frame: A string representing the frame location, or a bytes-like
+            object holding the encoded frame.
+            frame_id: An int identifying the frame.
+
+        Returns:
+            None
+
+        Raises:
+            OSError: The server stayed unreachable after all retries.
+        """
+
+        if isinstance(frame, str):
+            with open(frame, 'rb') as filedesc:
+                frame = filedesc.read()
+
+        for attempt in range(self.retry + 1):
+            try:
+                self.connect()
+                break
+            except OSError:
+                self._drop()
+                if attempt == self.retry:
+                    raise
+                time.sleep(self.delay)
+
+        send_frame_datagrams(self._datagram_sock,
+                             (self.address, self.datagram_port),
+                             frame, frame_id, self._token, self.rate)
+
+
+    def close(self):
+        """End the session and close both sockets.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        super().close()
+        self._datagram_sock.close()
+
+
+async def _async_recv_exact_into(loop, sock, view):
+    """Fill a writable buffer from a non-blocking socket."""
+
+    received = 0
+    while received < len(view):
+        nbytes = await loop.sock_recv_into(sock, view[received:])
+        if nbytes == 0:
+            raise ConnectionError("connection closed by peer")
+        received += nbytes
+
+
+async def async_receive_message(loop, sock, frame_buf):
+    """Receive one message from an asyncio event loop.
+
+    The payload is read into frame_buf, like receive_frame does.
+
+    Args:
+        loop: The running asyncio event loop.
+        sock: A non-blocking socket representing the peer connection.
+        frame_buf: A FrameBuffer instance receiving the payload bytes.
+
+    Returns:
+        A tuple (msg_type, frame_id, view), view being a memoryview over the
+        payload bytes.
+
+    Raises:
+        ProtocolError: The peer speaks another protocol version, or
+        announced a payload larger than MAX_FRAME_SIZE.
+    """
+
+    header = bytearray(HEADER.size)
+    await _async_recv_exact_into(loop, sock, memoryview(header))
+    msg_type, frame_id, length = _unpack_header(header)
+
+    view = frame_buf.view(length)
+    await _async_recv_exact_into(loop, sock, view)
+
+    return msg_type, frame_id, view
+
+
+async def async_receive_frame(loop, client_sock, frame_buf):
+    """Receive one frame from an asyncio event loop.
+
+    Asynchronous counterpart of receive_frame, for non-blocking sockets.
+
+    Args:
+        loop: The running asyncio event loop.
+        client_sock: A non-blocking socket representing a client connection.
+        frame_buf: A FrameBuffer instance receiving the frame bytes.
+
+    Returns:
+        A tuple (frame_id, view) as returned by receive_frame.
+
+    Raises:
+        ProtocolError: The peer sent something other than a frame.
+    """
+
+    msg_type, frame_id, view = await async_receive_message(loop, client_sock,
+                                                           frame_buf)
+    if msg_type == MSG_BYE:
+        return None, None
+    if msg_type != MSG_FRAME:
+        raise ProtocolError("expected frame, got message type %d" % msg_type)
+
+    return frame_id, view
+
+
+async def async_send_message(loop, sock, msg_type, frame_id, payload=b''): #pylint: disable=too-many-arguments
+    """Send one message from an asyncio event loop.
+
+    Args:
+        loop: The running asyncio event loop.
+        sock: A non-blocking socket representing the peer connection.
+        msg_type: An int representing the message type (MSG_*).
+        frame_id: An int identifying the frame the message refers to.
+        payload: Optional bytes-like object carried by the message.
+
+    Returns:
+        None
+    """
+
+    header = HEADER.pack(PROTOCOL_VERSION, msg_type, frame_id, len(payload))
+    await loop.sock_sendall(sock, header + bytes(payload))
+
+
+async def async_send_result(loop, client_sock, frame_id, vector):
+    """Send a translation vector result from an asyncio event loop.
+
+    Args:
+        loop: The running asyncio event loop.
+        client_sock: A non-blocking socket representing the client connection.
+        frame_id: An int identifying the frame the result refers to.
+        vector: A (x, y) tuple, or an empty value when nothing was detected.
+
+    Returns:
+        None
+    """
+
+    await async_send_message(loop, client_sock, MSG_RESULT, frame_id,
+                             _pack_vector(vector))
+
+
+async def async_send_error(loop, client_sock, frame_id, msg):
+    """Send an error message from an asyncio event loop.
+
+    Args:
+        loop: The running asyncio event loop.
+        client_sock: A non-blocking socket representing the client connection.
+        frame_id: An int identifying the frame the error refers to.
+        msg: A string describing the error.
+
+    Returns:
+        None
+    """
+
+    await async_send_message(loop, client_sock, MSG_ERROR, frame_id,
+                             str(msg).encode('utf-8'))
+
+
+class AsyncDatagramFrames(asyncio.DatagramProtocol):
+    """Server-side datagram endpoint keeping the newest frame per session.
+
+    Only chunks carrying the token of a registered session are listened
+    to, whatever address they come from. When a new frame completes before
+    the previous one was taken, the previous one is dropped: a late frame
+    is worse than no frame for steering.
+
+    Attributes:
+        superseded: An int counting complete frames dropped unprocessed.
+    """
+
+    def __init__(self):
+        """AsyncDatagramFrames default builder."""
+
+        super().__init__()
+        self.superseded = 0
+        self._reassemblers = {}
+        self._latest = {}
+        self._ready = {}
+
+
+    def register(self, token):
+        """Start accepting frames carrying token.
+
+        Args:
+            token: An int representing the session token from HELLO.
+
+        Returns:
+            None
+        """
+
+        self._reassemblers[token] = DatagramReassembler()
+        self._ready[token] = asyncio.Event()
+
+
+    def unregister(self, token):
+        """Stop accepting frames carrying token.
+
+        Args:
+            token: An int representing the session token from HELLO.
+
+        Returns:
+            A DatagramReassembler holding the session statistics.
+        """
+
+        self._latest.pop(token, None)
+        self._ready.pop(token, None)
+
+        return self._reassemblers.pop(token, None)
+
+
+    def datagram_received(self, data, addr):
+        """Feed a chunk to the reassembler of its session."""
+
+        if len(data) < CHUNK.size:
+            return
+
+        token = CHUNK.unpack_from(data)[1]
+        reassembler = self._reassemblers.get(token)
+        if reassembler is None:
+            return
+
+        frame = reassembler.feed(data)
+        if frame is None:
+            return
+
+        if token in self._latest:
+            self.superseded += 1
+        self._latest[token] = frame
+        self._ready[token].set()
+
+
+    async def next_frame(self, token):
+        """Wait for the newest complete frame of a session.
+
+        Args:
+            token: An int representing the session token from HELLO.
+
+        Returns:
+            A tuple (frame_id, frame).
+        """
+
+        ready = self._ready[token]
+        await ready.wait()
+        ready.clear()
+
+        return self._latest.pop(token)
+
+
+async def async_send_info(loop, client_sock, input_size):
+    """Greet a new client from an asyncio event loop.
+
+    Args:
+        loop: The running asyncio event loop.
+        client_sock: A non-blocking socket representing the client connection.
+        input_size: A (width, height) tuple, or None when unknown.
 
     Returns:
         None
     """
 
-    client_sock.send((str(msg)).encode('ascii'))
+    await async_send_message(loop, client_sock, MSG_INFO, 0,
+                             INFO.pack(*(input_size or (0, 0))))
@@ -0,0 +1,84 @@
+"""
+Module supporting region-of-interest inference around a tracked target.
+
+class RoiTracker: remembers the last target box of a session and picks the
+region of the next frame to run the network on.
+"""
+
+
+class RoiTracker():
+    """Remembers the last target box of a session to crop the next frames.
+
+    A full-frame pass runs first, after every miss and every refresh frames;
+    in between, only an expanded region around the last box is processed.
+
+    Attributes:
+        expand: A float representing the ROI size relative to the last box.
+        refresh: An int; a full-frame pass is forced every refresh frames,
+        0 never forces one.
+        min_size: An int representing the minimum ROI side in pixels.
+        box: The last (x, y, w, h) center box in frame pixels, or None.
+        full_count: An int counting the full-frame passes.
+        roi_count: An int counting the ROI passes.
+    """
+
+    def __init__(self, expand=3.0, refresh=10, min_size=96):
+        """RoiTracker default builder."""
+
+        self.expand = expand
+        self.refresh = refresh
+        self.min_size = min_size
+        self.box = None
+        self.full_count = 0
+        self.roi_count = 0
+        self._frames = 0
+
+
+    def region(self, width, height):
+        """Pick the region of the next frame to run the network on.
+
+        Args:
+            width: An int representing the frame width.
+            height: An int representing the frame height.
+
+        Returns:
+            A (x0, y0, x1, y1) crop in frame pixels, or None for a full-frame
+            pass.
+        """
+
+        frames = self._frames
+        self._frames += 1
+
+        if self.box is None or (self.refresh and frames % self.refresh == 0):
+            self.full_count += 1
+            return None
+
+        x_center, y_center, box_w, box_h = self.box
+        half_w = max(box_w * self.expand, self.min_size) / 2
+        half_h = max(box_h * self.expand, self.min_size) / 2
+
+        x_0 = max(0, int(x_center - half_w))
+        y_0 = max(0, int(y_center - half_h))
+        x_1 = min(width, int(x_center + half_w) + 1)
+        y_1 = min(height, int(y_center + half_h) + 1)
+
+        if x_1 - x_0 < 2 or y_1 - y_0 < 2:
+            self.full_count += 1
+            return None
+
+        self.roi_count += 1
+        return x_0, y_0, x_1, y_1
+
+
+    def update(self, box):
+        """Record the target box found in the last frame.
+
+        Args:
+            box: A (x, y, w, h) center box in frame pixels, or None on a
+            miss, which makes the next frame a full-frame pass.
+
+        Returns:
+            None
+        """
+
+        self.box = box
@@ -122,21 +122,25 @@ def init_environ_darknet():
     """Return necessary darknet variables, based on environ params.
 
     Explicits darknet folder, darknet configuration file, weight, data and
-    label to use.
+    label to use, as well as the number of inference worker processes and
+    the inference backend.
 
     Args:
         None
 
     Returns:
         A dict containing: {string darknet_folder, string darknet_label,
-        string darknet_cfg, string darknet_weights, string darknet_data}
+        string darknet_cfg, string darknet_weights, string darknet_data,
+        int workers, string backend}
     """
 
     darknet_environ = {'folder':os.environ['CARO_DARKNET_FOLDER'],
                        'label':os.environ['CARO_DARKNET_LABEL'],
                        'cfg':os.environ['CARO_DARKNET_CFG'],
                        'weights':os.environ['CARO_DARKNET_WEIGHTS'],
-                       'data':os.environ['CARO_DARKNET_DATA']}
+                       'data':os.environ['CARO_DARKNET_DATA'],
+                       'workers':int(os.environ['CARO_DARKNET_WORKERS']),
+                       'backend':os.environ['CARO_DARKNET_BACKEND']}
 
     return darknet_environ
 
@@ -0,0 +1,274 @@
+"""
+Module supporting the multi-process inference worker pool.
+
+The model is loaded once in the parent process; workers are forked from it
+and share the weights copy-on-write. Encoded frames are handed to workers
+through shared memory slots, and only small (ticket, status, result)
+tuples travel through queues. A worker that dies fails the frame it was
+running and is replaced.
+
+class WorkerPool: forks inference workers and dispatches frames to them.
+"""
+
+import logging
+import threading
+import itertools
+import multiprocessing as mp
+import multiprocessing.connection
+
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import socks
+
+
+def _worker_main(target, model, slots, tasks, results, running): #pylint: disable=too-many-arguments
+    """Worker process body: run target on frames until told to stop.
+
+    Args:
+        target: A function (model, view) returning a picklable result.
+        model: The model handed to target.
+        slots: A list of SharedMemory instances holding incoming frames.
+        tasks: A queue of (ticket, slot, length) tuples, None to stop.
+        results: A queue receiving (ticket, ok, result) tuples.
+        running: A shared int where the ticket being processed is kept,
+        -1 when idle.
+
+    Returns:
+        None
+    """
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        ticket, slot, length = task
+        running.value = ticket
+        view = slots[slot].buf[:length]
+        try:
+            results.put((ticket, True, target(model, view)))
+        except Exception as err: #pylint: disable=broad-except
+            results.put((ticket, False, str(err)))
+        finally:
+            view.release()
+            running.value = -1
+
+
+class WorkerPool():
+    """Forks inference workers and dispatches frames to them.
+
+    Attributes:
+        workers: An int representing the number of worker processes.
+        slot_size: An int representing the maximum frame size in bytes,
+        socks.MAX_FRAME_SIZE by default so any frame the protocol accepts
+        fits in a slot.
+        slot_count: An int representing the number of shared memory slots,
+        i.e. the maximum number of frames in flight.
+    """
+
+    def __init__(self, target, model, workers, slot_count=None, #pylint: disable=too-many-arguments
+                 slot_size=socks.MAX_FRAME_SIZE):
+        """WorkerPool default builder."""
+
+        self.workers = workers
+        self.slot_size = slot_size
+        self.slot_count = slot_count or 2 * workers
+        self._target = target
+        self._model = model
+        self._ctx = mp.get_context('fork')
+        self._slots = []
+        self._procs = []
+        self._running = []
+        self._free = None
+        self._free_slots = []
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._tickets = itertools.count()
+        self._tasks = None
+        self._results = None
+        self._collector = None
+        self._monitor = None
+        self._wakeup = None
+
+
+    def __enter__(self):
+        """Start the pool."""
+
+        self.start()
+        return self
+
+
+    def __exit__(self, *_):
+        """Stop the pool."""
+
+        self.close()
+
+
+    def start(self):
+        """Allocate the shared memory slots and fork the workers.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        self._slots = [shared_memory.SharedMemory(create=True,
+                                                  size=self.slot_size)
+                       for _ in range(self.slot_count)]
+        self._free = threading.Semaphore(self.slot_count)
+        self._free_slots = list(range(self.slot_count))
+        self._tasks = self._ctx.SimpleQueue()
+        self._results = self._ctx.SimpleQueue()
+        self._running = [self._ctx.Value('q', -1, lock=False)
+                         for _ in range(self.workers)]
+        self._procs = [self._spawn(index) for index in range(self.workers)]
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+        self._wakeup = self._ctx.Pipe(duplex=False)
+        self._monitor = threading.Thread(target=self._watch, daemon=True)
+        self._monitor.start()
+
+        logging.getLogger('__main__').info("%d inference workers started",
+                                           self.workers)
+
+
+    def _spawn(self, index):
+        """Fork and start the worker process of a given index."""
+
+        self._running[index].value = -1
+        proc = self._ctx.Process(target=_worker_main,
+                                 args=(self._target, self._model, self._slots,
+                                       self._tasks, self._results,
+                                       self._running[index]),
+                                 daemon=True)
+        proc.start()
+
+        return proc
+
+
+    def _watch(self):
+        """Monitor thread body: fail the frame of a dead worker, replace it.
+
+        The failure goes through the results queue, behind any result the
+        worker put before dying, so the collector drops it when the frame
+        was already answered.
+        """
+
+        logger = logging.getLogger('__main__')
+        stop = self._wakeup[0]
+
+        while True:
+            sentinels = {proc.sentinel: index
+                         for index, proc in enumerate(self._procs)}
+            ready = mp.connection.wait(list(sentinels) + [stop])
+            if stop in ready:
+                break
+
+            for sentinel in ready:
+                index = sentinels[sentinel]
+                proc = self._procs[index]
+                proc.join()
+                ticket = self._running[index].value
+                logger.error("inference worker %d exited with code %s",
+                             proc.pid, str(proc.exitcode))
+                if ticket >= 0:
+                    self._results.put((ticket, False,
+                                       "inference worker exited with code %s"
+                                       % str(proc.exitcode)))
+                self._procs[index] = self._spawn(index)
+
+
+    def _collect(self):
+        """Collector thread body: resolve futures as results come back."""
+
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+
+            ticket, succeeded, result = item
+            with self._lock:
+                entry = self._pending.pop(ticket, None)
+                if entry is None:
+                    continue
+                slot, future = entry
+                self._free_slots.append(slot)
+            self._free.release()
+
+            if succeeded:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+
+
+    def submit(self, view):
+        """Copy a frame into a free slot and queue it for inference.
+
+        Blocks while all slots are in flight.
+
+        Args:
+            view: A bytes-like object holding the encoded frame.
+
+        Returns:
+            A concurrent.futures.Future resolving to the target result.
+
+        Raises:
+            ValueError: The frame does not fit in a slot.
+        """
+
+        length = len(view)
+        if length > self.slot_size:
+            raise ValueError("frame of %d bytes exceeds slot size %d"
+                             % (length, self.slot_size))
+
+        future = Future()
+
+        self._free.acquire()
+        with self._lock:
+            slot = self._free_slots.pop()
+            ticket = next(self._tickets)
+            self._pending[ticket] = (slot, future)
+
+        self._slots[slot].buf[:length] = view
+        self._tasks.put((ticket, slot, length))
+
+        return future
+
+
+    def close(self):
+        """Stop the workers and release the shared memory slots.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        if self._monitor is not None:
+            self._wakeup[1].send(None)
+            self._monitor.join()
+            self._monitor = None
+            for end in self._wakeup:
+                end.close()
+
+        for _ in self._procs:
+            self._tasks.put(None)
+        for proc in self._procs:
+            proc.join()
+        self._procs = []
+
+        if self._collector is not None:
+            self._results.put(None)
+            self._collector.join()
+            self._collector = None
+
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []